@@ -1,136 +1,276 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-
-
-"""This script is used to explore and audit the map."""
-
-import xml.etree.cElementTree as ET
-from collections import defaultdict
-import re
-import io
-
-#mapFile = io.open("riyadh_sample.osm", "r",encoding='utf8')
-mapFile = io.open("riyadh_saudi-arabia.osm", "r",encoding='utf8')
-tree = ET.parse(mapFile) #parse file into XML tree
-root = tree.getroot() #get the root node of the XML tree
-
-
-
-
-def countTags():
-    """count the number of unique tags or subtags"""
-    mapFile.seek(0)
-    tags = defaultdict(int)
-
-    # loop over every XML tag
-    for event, elem in ET.iterparse(mapFile):
-        # grouping tags and counting its number
-        tags[elem.tag] += 1
-    return tags
-
-def tagNameByLevel():
-    """finds and return the tag names structured by their level in a default dictionary.
-    The tag keys represent first level children.
-    The values associated with each key represent the child/children of that element.
-    It also represent the second level children of the root.
-    """
-    tagByLevel = defaultdict(set)
-
-    #loop on direct children of root
-    for element in root:
-
-        #loop on direct children of element
-        for child in list(element):
-            tagByLevel[element.tag].add(child.tag)
-    return tagByLevel
-
-
-
-
-
-def groupTagAttrib(tagParentName):
-    """
-    This function group the <tag> attribute values by their keys.
-    Notice that only tags that are children of the passed parameter are used.
-    Returns default dictionary where the dictionary keys represents the tag attribute keys and the dictionary values represents the tag attribute values associated with that key.
-    """
-
-    mapFile.seek(0)
-
-    tagAttribs = defaultdict(list)
-
-    # loop over only (tagParentName) element which are first level children
-    for node in root.findall('./' + tagParentName):
-
-        # loop over only the tag element which are second level children
-        for tag in node.findall("tag"):
-            tagAttribs[tag.attrib['k']].append(tag.attrib['v'])
-
-    return tagAttribs
-
-
-def attribSize(groupedAttribDict):
-    """
-    This function find the size of each key attribute.
-    Takes default dictionary of grouped tag attributes.
-    Returns the size or the number of values associated with each key.
-    """
-    attribSize = dict()
-
-    for k, v in groupedAttribDict.items():
-        attribSize[k] = len(v)
-
-    return attribSize
-
-
-def uniqTagValues(groupedAttribDict):
-    """
-    This function used to remove duplicated tag attrib values.
-    Takes default dictionary of grouped tag attributes.
-    Returns the same dictionay without duplicated values.
-    """
-    for k, v in groupedAttribDict.items():
-        groupedAttribDict[k] = set(v)
-
-    return groupedAttribDict
-
-
-def auditStreetTypes():
-    """This function returns the possible street types by extracting the last word in a street name"""
-    streetTypesDict = defaultdict(int)
-
-    mapFile.seek(0)
-
-    # matches one or more non-space charecter at the end of the string with optional ending dot
-    streetType_re = re.compile(r'\S+$', re.IGNORECASE)
-
-    # to loop over the xml element
-    for event, elem in ET.iterparse(mapFile):
-
-        # to check if the tag contains a street names
-        # street names are the values associted with (addr:street) key attribute
-        # example: <tag k="addr:street" v="Khurais Road" />
-        if (elem.tag == "tag") and (elem.attrib['k'] == "addr:street"):
-
-            streetName = elem.attrib['v']
-
-            # to extract the street type from street name which is usually the last word in the string
-            streetType = streetType_re.search(streetName)
-
-            # if there is a match, then the length of the returned value will be larger than zero (True)
-            if streetType:
-                # add street type to the dictionary if doesn't exist
-                # increment its count
-                streetTypesDict[streetType.group()] += 1
-
-    return streetTypesDict
-
-
-
-#--------------------------------------------------
-
-print(attribSize(groupTagAttrib("node")))
-print(uniqTagValues(groupTagAttrib("node")))
-
-print(attribSize(groupTagAttrib("way")))
-print(uniqTagValues(groupTagAttrib("way")))
\ No newline at end of file
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""This script is used to explore and audit the map.
+
+All the audits are visitors of a single streaming pass over the map (see auditMap),
+so the map is read once and never held in memory as a whole tree.
+"""
+
+import argparse
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+import re
+
+import osm_input
+import sketches
+
+#mapPath = "riyadh_sample.osm"
+mapPath = "riyadh_saudi-arabia.osm"
+
+# matches one or more non-space charecter at the end of the string with optional ending dot
+streetType_re = re.compile(r'\S+$', re.IGNORECASE)
+
+
+# ================================================== #
+#               Streaming Audit Engine               #
+# ================================================== #
+def iterMap(mapFile):
+    """Stream the map and yield the root followed by every first level child of the root.
+    The root is cleared after each child is yielded, so only one element is kept in memory.
+    Compressed maps (.bz2, .gz, .xz) are decompressed on the fly.
+    """
+    depth = 0
+
+    with osm_input.osm_input(mapFile) as stream:
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                if depth == 0:
+                    root = elem
+                    yield root
+                depth += 1
+            else:
+                depth -= 1
+                # only first level children are complete elements worth visiting
+                if depth == 1:
+                    yield elem
+                    root.clear()
+
+
+def auditMap(mapFile, visitors):
+    """Run all the visitors over the map in one pass and return their results in the same order"""
+    elements = iterMap(mapFile)
+
+    root = next(elements)
+    for visitor in visitors:
+        visitor.start(root)
+
+    for element in elements:
+        for visitor in visitors:
+            visitor.visit(element)
+
+    return [visitor.result() for visitor in visitors]
+
+
+class AuditVisitor(object):
+    """Base class of an audit. start() is called with the root, then visit() with every first level child,
+    result() returns what the audit found (None unless the audit overrides it)
+    """
+
+    def start(self, root):
+        pass
+
+    def visit(self, element):
+        pass
+
+    def result(self):
+        return None
+
+
+class TagCounter(AuditVisitor):
+    """count the number of unique tags or subtags"""
+
+    def __init__(self):
+        self.tags = defaultdict(int)
+
+    def start(self, root):
+        self.tags[root.tag] += 1
+
+    def visit(self, element):
+        # grouping tags and counting its number, the element itself included
+        for elem in element.iter():
+            self.tags[elem.tag] += 1
+
+    def result(self):
+        return self.tags
+
+
+class TagLevelVisitor(AuditVisitor):
+    """group the tag names of the second level children of the root by their parent tag name"""
+
+    def __init__(self):
+        self.tagByLevel = defaultdict(set)
+
+    def visit(self, element):
+        #loop on direct children of element
+        for child in element:
+            self.tagByLevel[element.tag].add(child.tag)
+
+    def result(self):
+        return self.tagByLevel
+
+
+class TagAttribGrouper(AuditVisitor):
+    """group the <tag> attribute values of (tagParentName) elements by their keys"""
+
+    def __init__(self, tagParentName):
+        self.tagParentName = tagParentName
+        self.tagAttribs = defaultdict(list)
+
+    def visit(self, element):
+        if element.tag == self.tagParentName:
+            # loop over only the tag element which are second level children
+            for tag in element.findall("tag"):
+                self.tagAttribs[tag.attrib['k']].append(tag.attrib['v'])
+
+    def result(self):
+        return self.tagAttribs
+
+
+class TagAttribSketcher(AuditVisitor):
+    """summarize the <tag> attribute values of (tagParentName) elements by their keys in fixed memory per key:
+    the exact number of values, the estimated number of unique values and the most frequent values
+    """
+
+    def __init__(self, tagParentName, precision=sketches.PRECISION, capacity=sketches.CAPACITY):
+        self.tagParentName = tagParentName
+        self.tagSketches = defaultdict(lambda: sketches.ValueSketch(precision, capacity))
+
+    def visit(self, element):
+        if element.tag == self.tagParentName:
+            for tag in element.findall("tag"):
+                self.tagSketches[tag.attrib['k']].add(tag.attrib['v'])
+
+    def result(self):
+        return self.tagSketches
+
+
+class StreetTypeAuditor(AuditVisitor):
+    """count the possible street types by extracting the last word in a street name"""
+
+    def __init__(self):
+        self.streetTypesDict = defaultdict(int)
+
+    def visit(self, element):
+        # street names are the values associted with (addr:street) key attribute
+        # example: <tag k="addr:street" v="Khurais Road" />
+        for tag in element.iter("tag"):
+            if tag.attrib['k'] == "addr:street":
+
+                # to extract the street type from street name which is usually the last word in the string
+                streetType = streetType_re.search(tag.attrib['v'])
+
+                if streetType:
+                    self.streetTypesDict[streetType.group()] += 1
+
+    def result(self):
+        return self.streetTypesDict
+
+
+# ================================================== #
+#               Audit Functions                      #
+# ================================================== #
+def countTags(mapFile=mapPath):
+    """count the number of unique tags or subtags"""
+    return auditMap(mapFile, [TagCounter()])[0]
+
+
+def tagNameByLevel(mapFile=mapPath):
+    """finds and return the tag names structured by their level in a default dictionary.
+    The tag keys represent first level children.
+    The values associated with each key represent the child/children of that element.
+    It also represent the second level children of the root.
+    """
+    return auditMap(mapFile, [TagLevelVisitor()])[0]
+
+
+def groupTagAttrib(tagParentName, mapFile=mapPath):
+    """
+    This function group the <tag> attribute values by their keys.
+    Notice that only tags that are children of the passed parameter are used.
+    Returns default dictionary where the dictionary keys represents the tag attribute keys and the dictionary values represents the tag attribute values associated with that key.
+    """
+    return auditMap(mapFile, [TagAttribGrouper(tagParentName)])[0]
+
+
+def sketchTagAttrib(tagParentName, mapFile=mapPath):
+    """
+    The approximate version of groupTagAttrib: the values of each key are summarized by a sketch instead of listed.
+    Returns default dictionary where the dictionary keys represents the tag attribute keys and the dictionary values represents the sketch of the values associated with that key.
+    attribSize works the same on it, approxUniqTagValues replaces uniqTagValues.
+    """
+    return auditMap(mapFile, [TagAttribSketcher(tagParentName)])[0]
+
+
+def attribSize(groupedAttribDict):
+    """
+    This function find the size of each key attribute.
+    Takes default dictionary of grouped tag attributes.
+    Returns the size or the number of values associated with each key.
+    """
+    attribSize = dict()
+
+    for k, v in groupedAttribDict.items():
+        attribSize[k] = len(v)
+
+    return attribSize
+
+
+def uniqTagValues(groupedAttribDict):
+    """
+    This function used to remove duplicated tag attrib values.
+    Takes default dictionary of grouped tag attributes.
+    Returns the same dictionay without duplicated values.
+    """
+    for k, v in groupedAttribDict.items():
+        groupedAttribDict[k] = set(v)
+
+    return groupedAttribDict
+
+
+def approxUniqTagValues(sketchedAttribDict, top=10):
+    """
+    The approximate version of uniqTagValues.
+    Takes default dictionary of sketched tag attributes.
+    Returns a dictionary of the estimated number of unique values and the (top) most frequent values associated with each key.
+    """
+    uniqValues = dict()
+
+    for k, v in sketchedAttribDict.items():
+        uniqValues[k] = (v.distinct(), [value for value, _, _ in v.top(top)])
+
+    return uniqValues
+
+
+def auditStreetTypes(mapFile=mapPath):
+    """This function returns the possible street types by extracting the last word in a street name"""
+    return auditMap(mapFile, [StreetTypeAuditor()])[0]
+
+
+
+def allAudits(approx=False):
+    """Return the visitors of all the audits run by this script, with approx the tag values are sketched"""
+    Grouper = TagAttribSketcher if approx else TagAttribGrouper
+    return [TagCounter(), TagLevelVisitor(), Grouper("node"), Grouper("way"), StreetTypeAuditor()]
+
+
+#--------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('map_file', nargs='?', default=mapPath, help="OSM file to audit")
+    parser.add_argument('--approx', action='store_true',
+                        help="summarize the tag values in fixed memory per key instead of keeping them all")
+    args = parser.parse_args()
+
+    uniqValues = approxUniqTagValues if args.approx else uniqTagValues
+
+    # every audit is computed in the same single pass over the map
+    tags, tagByLevel, nodeAttribs, wayAttribs, streetTypes = auditMap(args.map_file, allAudits(args.approx))
+
+    print(attribSize(nodeAttribs))
+    print(uniqValues(nodeAttribs))
+
+    print(attribSize(wayAttribs))
+    print(uniqValues(wayAttribs))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script holds batch versions of the xml_to_csv cleaning functions.
+They take whole arrays (lists, numpy arrays or pandas Series) of tag values and clean them with
+vectorized pandas string operations, using the same compiled patterns and mappings as xml_to_csv.
+Tag values repeat a lot, so every distinct value is cleaned only once.
+"""
+
+import pandas as pd
+
+import xml_to_csv
+
+
+def _distinct(values):
+    """Return the codes of the values and a Series of the distinct values"""
+    codes, uniques = pd.factorize(pd.Series(list(values), dtype=object))
+    return codes, pd.Series(uniques, dtype=object)
+
+
+def _like_input(values, codes, cleaned):
+    """Expand the cleaned distinct values back to the input, a Series keeps its index, anything else gives an array"""
+    cleaned = cleaned.values.take(codes)
+    if isinstance(values, pd.Series):
+        return pd.Series(cleaned, index=values.index, name=values.name)
+    return cleaned
+
+
+def cleanStreetNames(streetNames):
+    """Batch version of cleanStreetName.
+    Arabic names are kept, english names get their words title-cased (except abbreviations) and their type fixed.
+    """
+    codes, names = _distinct(streetNames)
+    cleaned = names.copy()
+
+    # only clean english text
+    english = ~names.str.contains(xml_to_csv.ARABIC_TEXT)
+    if english.any():
+        # one column per word position, shorter names are padded with nulls
+        words = names[english].str.split(expand=True)
+        wordCount = words.notnull().sum(axis=1)
+        joined = pd.Series('', index=words.index, dtype=object)
+
+        for position in words.columns:
+            word = words[position]
+            present = word.notnull()
+
+            # fixing the case of every word which is not an abbreviation
+            word = word.where(word.str.isupper().fillna(True).astype(bool), word.str.title())
+
+            # the last word of each name possibly represent the type
+            last = wordCount == position + 1
+            streetType = word[last].map(xml_to_csv.STREET_TYPE_MAPPING)
+            word[last] = streetType.where(streetType.notnull(), word[last])
+
+            joined[present] = (joined[present] + ' ' + word[present]) if position else word[present]
+
+        cleaned[english] = joined
+
+    return _like_input(streetNames, codes, cleaned)
+
+
+def cleanPhoneNumbers(phones):
+    """Batch version of cleanPhoneNumber.
+    Raises KeyError for the first invalid number missing from the mapping, like cleanPhoneNumber.
+    """
+    codes, numbers = _distinct(phones)
+    numbers = numbers.str.split(';', n=1).str[0]
+    cleaned = numbers.copy()
+    remaining = pd.Series(True, index=numbers.index)
+
+    # toll free, universal access, mobile then home numbers
+    for pattern, standard in xml_to_csv.PHONE_FORMATS:
+        match = remaining & numbers.str.match(pattern, na=False)
+        if match.any():
+            cleaned[match] = numbers[match].str.replace(pattern, standard)
+            remaining &= ~match
+
+    # invalid numbers
+    invalid = numbers[remaining]
+    unknown = ~invalid.isin(list(xml_to_csv.PHONE_MAPPING))
+    if unknown.any():
+        raise KeyError(invalid[unknown].iloc[0])
+    cleaned[remaining] = invalid.map(xml_to_csv.PHONE_MAPPING)
+
+    return _like_input(phones, codes, cleaned)
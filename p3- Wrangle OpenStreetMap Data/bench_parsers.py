@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script benchmarks the XML parser backends of osm_parsers on an OSM file.
+Every backend is timed reading the element parts only, then shaping them to the compact records of xml_to_csv,
+and its records are checked against the ones of the etree backend.
+"""
+
+import argparse
+import timeit
+
+import osm_parsers
+import xml_to_csv
+
+SAMPLE_PATH = 'riyadh_sample.osm'
+
+
+def read_parts(osm_file, parser):
+    """Consume the parts of every element and return their number"""
+    return sum(1 for _ in osm_parsers.iter_parts(osm_file, parser=parser))
+
+
+def read_records(osm_file, parser):
+    """Shape the records of every node, way and relation and return them"""
+    return list(xml_to_csv.get_records(osm_file, parser=parser))
+
+
+def benchmark(osm_file, repeat=5):
+    """Time every backend and print the comparison with the etree backend"""
+    reference = read_records(osm_file, 'etree')
+    timings = []
+
+    for parser in sorted(osm_parsers.PARSERS):
+        if read_records(osm_file, parser) != reference:
+            raise ValueError("parser '{0}' does not give the records of the etree parser".format(parser))
+
+        parse = min(timeit.repeat(lambda: read_parts(osm_file, parser), number=1, repeat=repeat))
+        shape = min(timeit.repeat(lambda: read_records(osm_file, parser), number=1, repeat=repeat))
+        timings.append((parser, parse, shape))
+
+    base = dict((parser, shape) for parser, _, shape in timings)['etree']
+
+    print('{0} elements in {1}'.format(read_parts(osm_file, 'etree'), osm_file))
+    print('{0:<10}{1:>12}{2:>14}{3:>10}'.format('parser', 'parse (ms)', 'records (ms)', 'speedup'))
+    for parser, parse, shape in timings:
+        print('{0:<10}{1:>12.1f}{2:>14.1f}{3:>9.2f}x'.format(parser, parse * 1000, shape * 1000, base / shape))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('osm_file', nargs='?', default=SAMPLE_PATH, help="OSM file to parse")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of every backend, the best one is kept")
+    args = parser.parse_args()
+
+    benchmark(args.osm_file, args.repeat)
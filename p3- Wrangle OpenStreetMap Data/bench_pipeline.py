@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script benchmarks the wrangling pipeline, stage by stage, on riyadh_sample.osm scaled up by generate_osm.py.
+Every stage runs in a fresh process so its peak RSS is its own:
+
+    parse:     read the element parts (osm_parsers)
+    shape:     parse and shape the compact records
+    validate:  parse, shape and validate the records
+    clean:     parse, shape and clean the street names and phone numbers
+    write_csv: process_map, the csv files of a full conversion without validation
+    load_db:   csv_to_db.py, loading the csv files, building the indexes and running its queries
+    queries:   the queries of bench_queries on the loaded database
+    audit:     all the audits of audit.py in one pass
+
+load_db needs write_csv to run before it, and queries needs load_db.
+The stages report their time, elements/sec and peak RSS, the results are appended to a JSON file
+so the runs of different versions can be compared.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import audit
+import bench_queries
+import clean_cache
+import generate_osm
+import osm_parsers
+import osm_pipeline
+import xml_to_csv
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESULTS_PATH = 'bench_results.json'
+
+STAGES = ['parse', 'shape', 'validate', 'clean', 'write_csv', 'load_db', 'queries', 'audit']
+
+# stage working on the output of an earlier stage: load_db reads the csv files, queries the database
+STAGE_INPUTS = {'load_db': 'write_csv', 'queries': 'load_db'}
+
+
+class NullWriter(object):
+    """Writer dropping the rows, to time the stages before the csv writing"""
+
+    def writerow(self, row):
+        pass
+
+    def writerows(self, rows):
+        pass
+
+
+NULL_WRITERS = dict((key, NullWriter()) for key, _, _ in xml_to_csv.CSV_OUTPUTS)
+
+
+def run_stage(stage, osm_file, work_dir, parser):
+    """Run the stage in the current process, from work_dir"""
+    os.chdir(work_dir)
+
+    if stage == 'parse':
+        for _ in osm_parsers.iter_parts(osm_file, parser=parser):
+            pass
+    elif stage == 'shape':
+        for _ in xml_to_csv.get_records(osm_file, parser=parser):
+            pass
+    elif stage == 'validate':
+        xml_to_csv.write_records(xml_to_csv.get_records(osm_file, parser=parser), NULL_WRITERS, True)
+    elif stage == 'clean':
+        cleaner = clean_cache.CleaningCache(xml_to_csv.cleanTagValue, xml_to_csv.CLEANED_KEYS)
+        xml_to_csv.write_records(xml_to_csv.get_records(osm_file, cleaner, parser), NULL_WRITERS, False)
+    elif stage == 'write_csv':
+        xml_to_csv.process_map(osm_file, validate=False, parser=parser)
+    elif stage == 'load_db':
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, os.path.join(SCRIPTS_DIR, 'csv_to_db.py')], stdout=devnull)
+    elif stage == 'queries':
+        conn = sqlite3.connect(bench_queries.DB_NAME)
+        try:
+            bench_queries.time_queries(conn.cursor(), repeat=1)
+        finally:
+            conn.close()
+    elif stage == 'audit':
+        audit.auditMap(osm_file, audit.allAudits())
+    else:
+        raise ValueError("unknown stage '{0}'".format(stage))
+
+
+def peak_rss_mb():
+    """Peak RSS in MB of this process and of its finished children (ru_maxrss is in KB on linux, bytes on mac)"""
+    unit = 1024.0 * 1024 if sys.platform == 'darwin' else 1024.0
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / unit
+
+
+def measure_stage(results, stage, osm_file, work_dir, parser):
+    """Process target timing one stage, puts (seconds, peak RSS in MB) or the stage error in results"""
+    try:
+        begin = time.time()
+        run_stage(stage, osm_file, work_dir, parser)
+        results.put((time.time() - begin, peak_rss_mb()))
+    except Exception as e:
+        results.put(osm_pipeline.picklable_error(e))
+
+
+def time_stage(stage, osm_file, work_dir, parser):
+    """Run the stage in a new process, so its peak RSS does not include the previous stages"""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure_stage, args=(results, stage, osm_file, work_dir, parser))
+    process.start()
+    try:
+        result = results.get()
+    finally:
+        process.join()
+
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def check_stages(stages):
+    """Raise ValueError if a stage runs without the stage making its input running before it"""
+    for i, stage in enumerate(stages):
+        if stage in STAGE_INPUTS and STAGE_INPUTS[stage] not in stages[:i]:
+            raise ValueError("the {0} stage needs the {1} stage to run before it".format(stage, STAGE_INPUTS[stage]))
+
+
+def benchmark_file(osm_file, stages=STAGES, parser=osm_parsers.DEFAULT_PARSER):
+    """Time the stages on the OSM file and return their results"""
+    check_stages(stages)
+    osm_file = os.path.abspath(osm_file)
+    elements = sum(1 for _ in osm_parsers.iter_parts(osm_file, parser=parser))
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    results = []
+
+    try:
+        for stage in stages:
+            seconds, rss = time_stage(stage, osm_file, work_dir, parser)
+
+            results.append({'stage': stage,
+                            'seconds': round(seconds, 4),
+                            'elements_per_sec': None if stage == 'queries' else round(elements / seconds, 1),
+                            'peak_rss_mb': round(rss, 1)})
+    finally:
+        shutil.rmtree(work_dir)
+
+    return {'file': os.path.basename(osm_file),
+            'bytes': os.path.getsize(osm_file),
+            'elements': elements,
+            'stages': results}
+
+
+def git_commit():
+    """Return the current git commit of the scripts, None outside of a git checkout"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=devnull,
+                                           cwd=SCRIPTS_DIR).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_run(run, results_path=RESULTS_PATH):
+    """Append the run to the JSON list of the runs in results_path"""
+    runs = []
+    if os.path.exists(results_path):
+        with open(results_path) as results_file:
+            runs = json.load(results_file)
+
+    runs.append(run)
+    with open(results_path, 'w') as results_file:
+        json.dump(runs, results_file, indent=2, sort_keys=True)
+
+
+def print_results(result):
+    print('{0}: {1} elements, {2:.1f} MB'.format(result['file'], result['elements'], result['bytes'] / 1e6))
+    print('{0:<12}{1:>10}{2:>14}{3:>14}'.format('stage', 'seconds', 'elements/s', 'peak RSS MB'))
+    for stage in result['stages']:
+        rate = stage['elements_per_sec']
+        print('{0:<12}{1:>10.3f}{2:>14}{3:>14.1f}'.format(stage['stage'], stage['seconds'],
+                                                         '-' if rate is None else '{0:.0f}'.format(rate),
+                                                         stage['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=float, nargs='+', default=[1, 10],
+                        help="synthetic files to benchmark, in sample sizes (1 is the size of the sample)")
+    parser.add_argument('--osm-file', help="benchmark this OSM file instead of synthetic ones")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help="stages to run")
+    parser.add_argument('--parser', choices=sorted(osm_parsers.PARSERS), default=osm_parsers.DEFAULT_PARSER,
+                        help="XML parser backend")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic files")
+    parser.add_argument('--results', default=RESULTS_PATH, help="JSON file the results are appended to")
+    args = parser.parse_args()
+
+    try:
+        check_stages(args.stages)
+    except ValueError as e:
+        parser.error(str(e))
+
+    run = {'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+           'commit': git_commit(),
+           'python': platform.python_version(),
+           'parser': args.parser,
+           'files': []}
+
+    if args.osm_file:
+        run['files'].append(benchmark_file(args.osm_file, args.stages, args.parser))
+        print_results(run['files'][-1])
+    else:
+        synthetic_dir = tempfile.mkdtemp(prefix='bench_osm_')
+        try:
+            for scale in args.scale:
+                osm_file = os.path.join(synthetic_dir, 'synthetic_{0:g}x.osm'.format(scale))
+                generate_osm.generate(osm_file, scale, os.path.join(SCRIPTS_DIR, generate_osm.SAMPLE_PATH),
+                                      args.seed)
+
+                result = benchmark_file(osm_file, args.stages, args.parser)
+                result['scale'] = scale
+                run['files'].append(result)
+                print_results(result)
+        finally:
+            shutil.rmtree(synthetic_dir)
+
+    save_run(run, args.results)
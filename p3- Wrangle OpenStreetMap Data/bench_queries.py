@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script benchmarks the database queries without and with the post-load indexes of db_schema.
+The indexes are dropped first, the queries timed, then the indexes are rebuilt and the queries timed again.
+"""
+
+import argparse
+import sqlite3
+import timeit
+
+import db_schema
+
+DB_NAME = 'RiyadhMapDB.db'
+
+TOP_QUERY = "SELECT value, COUNT(DISTINCT id) as count FROM {0} WHERE key='{1}' GROUP BY value ORDER BY count DESC LIMIT 7;"
+
+SUMMARY_QUERY = "SELECT value, distinct_count FROM tag_summary WHERE tags_table='{0}' AND key='{1}' ORDER BY distinct_count DESC LIMIT 7;"
+
+# nodes of a tag key in a bounding box of central Riyadh, through the nodes_rtree spatial index
+BBOX_QUERY = ("SELECT n.id FROM nodes_rtree r JOIN nodes n ON n.id = r.id "
+              "WHERE r.min_lat <= 24.74 AND r.max_lat >= 24.68 AND r.min_lon <= 46.71 AND r.max_lon >= 46.65 "
+              "AND EXISTS (SELECT 1 FROM nodes_tags t WHERE t.id = n.id AND t.key = '{0}');")
+
+# node edits per user and month, read from the (uid, timestamp) index
+EDITS_QUERY = ("SELECT uid, strftime('%Y-%m', timestamp, 'unixepoch') AS month, COUNT(*) FROM nodes "
+               "GROUP BY uid, month;")
+
+# name and sql of the benchmarked queries, the ones used to explore the map
+QUERIES = [('unique users', 'SELECT COUNT(*) as total FROM (SELECT user FROM nodes UNION SELECT user FROM ways);'),
+           ('nodes', 'SELECT COUNT(DISTINCT id) FROM nodes;'),
+           ('ways', 'SELECT COUNT(DISTINCT id) FROM ways;'),
+           ('ways of a node', 'SELECT id FROM ways_nodes WHERE node_id = (SELECT MAX(node_id) FROM ways_nodes);'),
+           ('nodes of a way', 'SELECT node_id FROM ways_nodes WHERE id = (SELECT MAX(id) FROM ways) ORDER BY position;')]
+QUERIES += [('top ' + key, TOP_QUERY.format('nodes_tags', key))
+            for key in ['amenity', 'cuisine', 'landuse', 'manufacturer', 'religion', 'natural']]
+QUERIES += [('top way ' + key, TOP_QUERY.format('ways_tags', key)) for key in ['highway', 'building']]
+QUERIES += [('summary ' + key, SUMMARY_QUERY.format(table, key))
+            for table, key in [('nodes_tags', 'amenity'), ('ways_tags', 'highway')]]
+QUERIES += [('bbox amenity', BBOX_QUERY.format('amenity'))]
+QUERIES += [('edits per user month', EDITS_QUERY)]
+
+
+def time_queries(cur, repeat):
+    """Return the best run time in seconds of every query"""
+    timings = []
+    for name, sql in QUERIES:
+        timings.append(min(timeit.repeat(lambda: cur.execute(sql).fetchall(), number=1, repeat=repeat)))
+    return timings
+
+
+def benchmark(db_name, repeat=5):
+    """Time the queries without then with the indexes and print the comparison"""
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    try:
+        db_schema.drop_indexes(cur)
+        conn.commit()
+        without = time_queries(cur, repeat)
+
+        db_schema.create_indexes(cur)
+        conn.commit()
+        indexed = time_queries(cur, repeat)
+    finally:
+        conn.close()
+
+    print('{0:<22}{1:>14}{2:>14}{3:>10}'.format('query', 'no index (ms)', 'indexed (ms)', 'speedup'))
+    for (name, _), before, after in zip(QUERIES, without, indexed):
+        print('{0:<22}{1:>14.2f}{2:>14.2f}{3:>9.1f}x'.format(name, before * 1000, after * 1000,
+                                                           before / max(after, 1e-9)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default=DB_NAME, help="database file name")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of every query, the best one is kept")
+    args = parser.parse_args()
+
+    benchmark(args.db, args.repeat)
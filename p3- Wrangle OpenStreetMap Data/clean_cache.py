@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script holds a bounded LRU cache in front of the tag value cleaning functions.
+The same street names and phone numbers repeat on many elements, so each (tag key, raw value)
+is cleaned once and the decision is reused, optionally across runs through a json file.
+"""
+
+from collections import OrderedDict
+import io
+import json
+import os
+
+CACHE_SIZE = 100000
+
+
+class CleaningCache(object):
+    """LRU cache of cleaner(key, value) for the tag keys in keys, the other values are returned untouched.
+    The instance is called like the cleaner itself.
+    """
+
+    def __init__(self, cleaner, keys, maxsize=CACHE_SIZE, path=None):
+        if maxsize < 1:
+            raise ValueError("the cleaning cache needs a size of 1 or more")
+
+        self.cleaner = cleaner
+        self.keys = frozenset(keys)
+        self.maxsize = maxsize
+        self.path = path
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __call__(self, key, value):
+        if key not in self.keys:
+            return value
+
+        try:
+            # pop and insert again to mark the entry as the most recently used
+            cleaned = self.cache.pop((key, value))
+            self.hits += 1
+        except KeyError:
+            # cleaning errors are raised and never cached
+            cleaned = self.cleaner(key, value)
+            self.misses += 1
+
+            if len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
+
+        self.cache[(key, value)] = cleaned
+        return cleaned
+
+    def load(self, path):
+        """Load the entries saved by save(), the most recently used last"""
+        with io.open(path, 'r', encoding='utf-8') as cache_file:
+            for key, value, cleaned in json.load(cache_file)[-self.maxsize:]:
+                self.cache[(key, value)] = cleaned
+
+    def save(self, path=None):
+        """Save the entries to a json file so the next run can reuse them"""
+        entries = [[key, value, cleaned] for (key, value), cleaned in self.cache.items()]
+        with io.open(path or self.path, 'wb') as cache_file:
+            cache_file.write(json.dumps(entries, ensure_ascii=True).encode('ascii'))
+
+    def stats(self):
+        """Return a one line summary of the cache counters"""
+        lookups = self.hits + self.misses
+        return 'cleaning cache: {0} hits, {1} misses ({2:.1%} hit rate), {3} entries'.format(
+            self.hits, self.misses, float(self.hits) / lookups if lookups else 0.0, len(self.cache))
@@ -1,110 +1,238 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-
-"""
-This script is used for creating, filling and querying the database
-Ref: https://discussions.udacity.com/t/creating-db-file-from-csv-files-with-non-ascii-unicode-characters/174958/7
-"""
-
-import sqlite3
-import csv
-from pprint import pprint
-
-
-def drop_table(tableName):
-    # drop all the tables before creating any
-    cur.execute('DROP TABLE IF EXISTS '+tableName)
-    conn.commit()  # save db changes
-
-def query(var,top):
-
-    if top:
-        cur.execute('SELECT  value, COUNT(DISTINCT id) as count FROM nodes_tags WHERE key=\''+var+'\' GROUP BY value ORDER BY count DESC LIMIT 7;')
-    else:
-        cur.execute(var)
-
-    rows = cur.fetchall(var)
-    pprint(rows)
-
-
-#database file name
-db_name = 'RiyadhMapDB.db'
-
-# Connect to the database
-conn = sqlite3.connect(db_name)
-
-# Get a cursor object
-cur = conn.cursor()
-
-drop_table('ways')
-drop_table('ways_tags')
-drop_table('ways_nodes')
-drop_table('nodes')
-drop_table('nodes_tags')
-
-
-
-#create table: ways
-cur.execute("CREATE TABLE ways (id, user, uid, version, changeset, timestamp);")
-with open('ways.csv','rt') as file:
-
-    csv_to_list = [(i['id'].decode("utf-8"), i['user'].decode("utf-8"), i['uid'].decode("utf-8"), i['version'].decode("utf-8"), i['changeset'].decode("utf-8"), i['timestamp'].decode("utf-8")) for i in csv.DictReader(file)]
-
-cur.executemany("INSERT INTO ways (id, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?);", csv_to_list)
-conn.commit()
-
-#create table: ways_tags
-cur.execute("CREATE TABLE ways_tags (id, key, value, type);")
-with open('ways_tags.csv','rt') as file:
-
-    csv_to_list = [(i['id'].decode("utf-8"), i['key'].decode("utf-8"), i['value'].decode("utf-8"), i['type'].decode("utf-8")) for i in csv.DictReader(file)]
-
-cur.executemany("INSERT INTO ways_tags (id, key, value, type) VALUES (?, ?, ?, ?);", csv_to_list)
-conn.commit()
-
-#create table: ways_nodes
-cur.execute("CREATE TABLE ways_nodes (id, node_id, position);")
-with open('ways_nodes.csv','rt') as file:
-
-    csv_to_list = [(i['id'].decode("utf-8"), i['node_id'].decode("utf-8"), i['position'].decode("utf-8")) for i in csv.DictReader(file)]
-
-cur.executemany("INSERT INTO ways_nodes (id, node_id, position) VALUES (?, ?, ?);", csv_to_list)
-conn.commit()
-
-
-# Create table: nodes
-cur.execute("CREATE TABLE nodes (id, lat, lon, user, uid, version, changeset, timestamp);")
-with open('nodes.csv','rt') as file:
-    csv_to_list = [(i['id'].decode("utf-8"), i['lat'].decode("utf-8"), i['lon'].decode("utf-8"), i['user'].decode("utf-8"), i['uid'].decode("utf-8"), i['version'].decode("utf-8"), i['changeset'].decode("utf-8"), i['timestamp'].decode("utf-8")) \
-             for i in csv.DictReader(file)]
-
-cur.executemany("INSERT INTO nodes (id, lat, lon, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", csv_to_list)
-conn.commit()
-
-#create table: nodes_tags
-cur.execute("CREATE TABLE nodes_tags (id, key, value, type);")
-with open('nodes_tags.csv','rt') as file:
-
-    csv_to_list = [(i['id'].decode("utf-8"), i['key'].decode("utf-8"), i['value'].decode("utf-8"), i['type'].decode("utf-8")) for i in csv.DictReader(file)]
-
-cur.executemany("INSERT INTO nodes_tags (id, key, value, type) VALUES (?, ?, ?, ?);", csv_to_list)
-conn.commit()
-
-
-#---------------------------------------------querying the database--------------------------------------------------
-
-query('SELECT COUNT(*) as total FROM (SELECT user FROM nodes UNION SELECT user FROM ways) ', False)
-query('SELECT COUNT(DISTINCT id) FROM nodes;',False)
-query('SELECT COUNT(DISTINCT id) FROM ways;',False)
-
-
-query('amenity',True)
-
-query('cuisine',True)
-query('landuse',True)
-query('manufacturer',True)
-query('religion',True)
-query('natural',True)
-
-#close db connection
-conn.close()
\ No newline at end of file
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script is used for creating, filling and querying the database
+Ref: https://discussions.udacity.com/t/creating-db-file-from-csv-files-with-non-ascii-unicode-characters/174958/7
+"""
+
+import argparse
+import itertools
+import math
+import numbers
+import sqlite3
+import csv
+from pprint import pprint
+
+import db_schema
+import node_store
+
+#database file name
+db_name = 'RiyadhMapDB.db'
+
+# rows inserted and committed together, bounds the memory used whatever the csv size is
+CHUNK_SIZE = 50000
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+# sqlite strftime format of the periods of edits_per_period
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+# table name and csv file of every table, in loading order (the columns are defined in db_schema)
+TABLES = [('ways', 'ways.csv'),
+          ('ways_tags', 'ways_tags.csv'),
+          ('ways_nodes', 'ways_nodes.csv'),
+          ('nodes', 'nodes.csv'),
+          ('nodes_tags', 'nodes_tags.csv'),
+          ('relations', 'relations.csv'),
+          ('relations_members', 'relations_members.csv'),
+          ('relations_tags', 'relations_tags.csv')]
+
+
+def drop_table(conn, tableName):
+    # drop all the tables before creating any
+    conn.execute('DROP TABLE IF EXISTS '+tableName)
+    conn.commit()  # save db changes
+
+def query(cur, var, top, tagsTable='nodes_tags'):
+    """Print the rows of the sql query (var), or the top values of the tag key (var) read from tag_summary"""
+
+    if top:
+        cur.execute('SELECT value, distinct_count as count FROM tag_summary WHERE tags_table = ? AND key = ? ORDER BY distinct_count DESC LIMIT 7;', (tagsTable, var))
+    else:
+        cur.execute(var)
+
+    rows = cur.fetchall()
+    pprint(rows)
+
+
+def query_bbox(cur, minLat, minLon, maxLat, maxLon, key=None, value=None, elements='nodes'):
+    """Return the nodes (id, lat, lon) in the bounding box or the ways (id, min_lat, min_lon, max_lat, max_lon)
+    whose bounding box intersects it, found with the R*Tree indexes.
+    With key (and value), only the elements having this tag are returned.
+    """
+    if elements == 'nodes':
+        sql = ('''SELECT n.id, n.lat, n.lon FROM nodes_rtree r JOIN nodes n ON n.id = r.id
+                  WHERE r.min_lat <= :max_lat AND r.max_lat >= :min_lat
+                  AND r.min_lon <= :max_lon AND r.max_lon >= :min_lon
+                  AND n.lat BETWEEN :min_lat AND :max_lat AND n.lon BETWEEN :min_lon AND :max_lon''')
+    elif elements == 'ways':
+        sql = ('''SELECT r.id, r.min_lat, r.min_lon, r.max_lat, r.max_lon FROM ways_rtree r
+                  WHERE r.min_lat <= :max_lat AND r.max_lat >= :min_lat
+                  AND r.min_lon <= :max_lon AND r.max_lon >= :min_lon''')
+    else:
+        raise ValueError("elements must be 'nodes' or 'ways', not {0!r}".format(elements))
+
+    if key is not None:
+        sql += ' AND EXISTS (SELECT 1 FROM {0}_tags t WHERE t.id = r.id AND t.key = :key'.format(elements)
+        sql += ' AND t.value = :value)' if value is not None else ')'
+
+    return cur.execute(sql + ';', {'min_lat': minLat, 'min_lon': minLon, 'max_lat': maxLat, 'max_lon': maxLon,
+                                   'key': key, 'value': value}).fetchall()
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great circle distance in meters between two points in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def query_radius(cur, lat, lon, radius, key=None, value=None, elements='nodes'):
+    """Return the nodes or the ways (see query_bbox) within radius meters of (lat, lon), closest first.
+    A way is within the radius when its bounding box comes within it, the distance of a way is the distance
+    to the nearest point of its bounding box.
+    """
+    # bounding box of the circle: its angular radius in latitude, the widest longitude it reaches
+    angle = radius / EARTH_RADIUS
+    latDelta = math.degrees(angle)
+    lonDelta = math.degrees(math.asin(min(math.sin(angle) / max(math.cos(math.radians(lat)), 1e-9), 1.0)))
+    rows = query_bbox(cur, lat - latDelta, lon - lonDelta, lat + latDelta, lon + lonDelta, key, value, elements)
+
+    distances = []
+    for row in rows:
+        if elements == 'nodes':
+            nearest = row[1:3]
+        else:
+            # nearest point of the way bounding box
+            nearest = (min(max(lat, row[1]), row[3]), min(max(lon, row[2]), row[4]))
+        meters = distance(lat, lon, nearest[0], nearest[1])
+        if meters <= radius:
+            distances.append((meters, row))
+
+    return [row for _, row in sorted(distances)]
+
+
+def edits_per_period(cur, period='month', byUser=True, uid=None, since=None, until=None,
+                     tables=db_schema.USER_TABLES):
+    """Return the (uid, period, edits) of the elements last edited in every period (day, month or year),
+    or the (period, edits) without byUser, in order.
+    uid, since and until (epoch seconds, like time.time(), or ISO dates/timestamps, until excluded) restrict
+    the edits counted, they are answered by the (uid, timestamp) and (timestamp) indexes.
+    """
+    conditions, params = [], []
+    if uid is not None:
+        conditions.append('uid = ?')
+        params.append(uid)
+    for bound, operator in ((since, '>='), (until, '<')):
+        if bound is not None:
+            conditions.append('timestamp {0} ?'.format(operator))
+            # the stored timestamps are whole seconds
+            params.append(int(math.ceil(bound)) if isinstance(bound, numbers.Real) else db_schema.epoch_seconds(bound))
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    edits = ' UNION ALL '.join('SELECT uid, timestamp FROM {0}{1}'.format(table, where) for table in tables)
+    groups = 'uid, period' if byUser else 'period'
+
+    sql = ('''SELECT {0}, COUNT(*) FROM (SELECT uid, strftime('{1}', timestamp, 'unixepoch') AS period FROM ({2}))
+              GROUP BY {0} ORDER BY {0};'''.format(groups, PERIOD_FORMATS[period], edits))
+    return cur.execute(sql, params * len(tables)).fetchall()
+
+
+def csv_rows(fileName, fields):
+    """Yield the rows of the csv file one by one as tuples of unicode values in the fields order"""
+    with open(fileName, 'rt') as file:
+        for i in csv.DictReader(file):
+            yield tuple(i[field].decode("utf-8") for field in fields)
+
+
+def load_table(conn, tableName, fileName, chunkSize=CHUNK_SIZE):
+    """Create the typed table then fill it from the csv file, one transaction per chunk of rows"""
+    cur = conn.cursor()
+    cur.execute(db_schema.create_table_sql(tableName))
+    insert = db_schema.insert_sql(tableName)
+
+    rows = csv_rows(fileName, db_schema.table_columns(tableName))
+    convert = db_schema.load_converter(tableName)
+    if convert:
+        rows = (convert(row) for row in rows)
+    total = 0
+
+    while True:
+        chunk = list(itertools.islice(rows, chunkSize))
+        if not chunk:
+            break
+
+        cur.executemany(insert, chunk)
+        conn.commit()
+
+        total += len(chunk)
+        print('{0}: {1} rows loaded'.format(tableName, total))
+
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows per insert transaction")
+    parser.add_argument('--normalized', action='store_true',
+                        help="store the user names, tag keys and common tag values once (read only database)")
+    parser.add_argument('--node-store', metavar='DIR',
+                        help="node store written by xml_to_csv.py --node-store, loads the ways_geom table")
+    args = parser.parse_args()
+
+    # Connect to the database
+    conn = sqlite3.connect(db_name)
+
+    # Get a cursor object
+    cur = conn.cursor()
+
+    db_schema.drop_normalized_tables(cur)
+    # the way geometries of a former load are only rebuilt with --node-store
+    for tableName in [name for name, _ in TABLES] + ['ways_geom']:
+        drop_table(conn, tableName)
+
+    for tableName, fileName in TABLES:
+        load_table(conn, tableName, fileName, args.chunk_size)
+
+    # indexes, tag statistics and spatial indexes are cheaper to build once the tables are full
+    db_schema.create_indexes(cur)
+    db_schema.build_tag_summary(cur)
+    db_schema.build_spatial_index(cur)
+    conn.commit()
+
+    if args.node_store:
+        ways = node_store.load_ways_geom(cur, node_store.NodeStore(args.node_store), 'ways_nodes.csv')
+        conn.commit()
+        print('ways_geom: {0} rows loaded'.format(ways))
+
+    if args.normalized:
+        db_schema.normalize_tables(cur)
+        conn.commit()
+        cur.execute('VACUUM;')
+
+
+    #---------------------------------------------querying the database--------------------------------------------------
+
+    query(cur, 'SELECT COUNT(*) as total FROM (SELECT user FROM nodes UNION SELECT user FROM ways) ', False)
+    query(cur, 'SELECT COUNT(DISTINCT id) FROM nodes;',False)
+    query(cur, 'SELECT COUNT(DISTINCT id) FROM ways;',False)
+
+
+    query(cur, 'amenity',True)
+
+    query(cur, 'cuisine',True)
+    query(cur, 'landuse',True)
+    query(cur, 'manufacturer',True)
+    query(cur, 'religion',True)
+    query(cur, 'natural',True)
+
+    # amenities within 2 km of the center of Riyadh
+    pprint(query_radius(cur, 24.7136, 46.6753, 2000, 'amenity')[:7])
+
+    # edits of the last 12 months with edits
+    pprint(edits_per_period(cur, 'month', False)[-12:])
+
+    #close db connection
+    conn.close()
\ No newline at end of file
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script defines the database layout of the map tables.
+The column types are derived from the cerberus schema in schema.py, the columns follow the csv fields order.
+"""
+
+import calendar
+import time
+
+import schema
+
+SQL_TYPES = {'integer': 'INTEGER', 'float': 'REAL', 'string': 'TEXT'}
+
+# epoch seconds of the days already seen by epoch_seconds
+DAY_EPOCHS = {}
+
+
+def epoch_seconds(timestamp):
+    """Return the epoch seconds of an OSM timestamp (2015-03-17T10:04:58Z) or of a date (2015-03-17), in UTC"""
+    day = timestamp[:10]
+    seconds = DAY_EPOCHS.get(day)
+    if seconds is None:
+        seconds = DAY_EPOCHS[day] = calendar.timegm(time.strptime(day, '%Y-%m-%d'))
+
+    if len(timestamp) == 10:
+        return seconds
+    if len(timestamp) != 20 or timestamp[10] != 'T' or timestamp[19] != 'Z':
+        raise ValueError("'{0}' is not an OSM timestamp like 2015-03-17T10:04:58Z".format(timestamp))
+    return seconds + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+
+# columns stored differently than in the csv files: sql type and conversion of the csv value when loaded
+COLUMN_CONVERSIONS = {'timestamp': ('INTEGER', epoch_seconds)}
+
+# table name, schema.py key and columns of every table
+TABLES = [('nodes', 'node', ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+          ('nodes_tags', 'node_tags', ['id', 'key', 'value', 'type']),
+          ('ways', 'way', ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+          ('ways_nodes', 'way_nodes', ['id', 'node_id', 'position']),
+          ('ways_tags', 'way_tags', ['id', 'key', 'value', 'type']),
+          ('relations', 'relation', ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+          ('relations_members', 'relation_members', ['id', 'member_type', 'member_id', 'role', 'position']),
+          ('relations_tags', 'relation_tags', ['id', 'key', 'value', 'type'])]
+
+# a single integer key becomes the rowid, a composite key makes a WITHOUT ROWID table clustered on it
+PRIMARY_KEYS = {'nodes': ['id'],
+                'ways': ['id'],
+                'ways_nodes': ['id', 'position'],
+                'relations': ['id'],
+                'relations_members': ['id', 'position']}
+
+# index name, table and columns of the indexes built after the bulk load
+# ways_nodes and relations_members (id, position) are already covered by their primary keys
+INDEXES = [('nodes_tags_key_value', 'nodes_tags', ['key', 'value']),
+           ('ways_tags_key_value', 'ways_tags', ['key', 'value']),
+           ('ways_nodes_node_id', 'ways_nodes', ['node_id']),
+           ('nodes_tags_id', 'nodes_tags', ['id']),
+           ('ways_tags_id', 'ways_tags', ['id']),
+           ('relations_tags_key_value', 'relations_tags', ['key', 'value']),
+           ('relations_tags_id', 'relations_tags', ['id']),
+           ('relations_members_member', 'relations_members', ['member_type', 'member_id']),
+           ('nodes_timestamp', 'nodes', ['timestamp']),
+           ('ways_timestamp', 'ways', ['timestamp']),
+           ('relations_timestamp', 'relations', ['timestamp']),
+           ('nodes_uid_timestamp', 'nodes', ['uid', 'timestamp']),
+           ('ways_uid_timestamp', 'ways', ['uid', 'timestamp']),
+           ('relations_uid_timestamp', 'relations', ['uid', 'timestamp'])]
+
+# tags tables summarized in tag_summary
+TAGS_TABLES = ['nodes_tags', 'ways_tags', 'relations_tags']
+
+# number of distinct elements of every (key, value) pair of the tags tables, the top values of a key are an index lookup
+TAG_SUMMARY_SQL = ('CREATE TABLE tag_summary (tags_table TEXT, key TEXT, value TEXT, distinct_count INTEGER, '
+                   'PRIMARY KEY (tags_table, key, value)) WITHOUT ROWID;')
+TAG_SUMMARY_INDEX_SQL = 'CREATE INDEX tag_summary_top ON tag_summary (tags_table, key, distinct_count DESC);'
+
+# keep tag_summary up to date when tags are inserted or deleted after the load,
+# an element is counted once per (key, value) whatever the number of its matching rows
+TAG_SUMMARY_TRIGGERS_SQL = ['''
+CREATE TRIGGER {0}_summary_insert AFTER INSERT ON {0}
+WHEN (SELECT COUNT(*) FROM {0} WHERE id = NEW.id AND key = NEW.key AND value = NEW.value) = 1
+BEGIN
+    INSERT OR IGNORE INTO tag_summary VALUES ('{0}', NEW.key, NEW.value, 0);
+    UPDATE tag_summary SET distinct_count = distinct_count + 1
+    WHERE tags_table = '{0}' AND key = NEW.key AND value = NEW.value;
+END;''', '''
+CREATE TRIGGER {0}_summary_delete AFTER DELETE ON {0}
+WHEN NOT EXISTS (SELECT 1 FROM {0} WHERE id = OLD.id AND key = OLD.key AND value = OLD.value)
+BEGIN
+    UPDATE tag_summary SET distinct_count = distinct_count - 1
+    WHERE tags_table = '{0}' AND key = OLD.key AND value = OLD.value;
+    DELETE FROM tag_summary WHERE tags_table = '{0}' AND key = OLD.key AND value = OLD.value AND distinct_count <= 0;
+END;''']
+
+
+# R*Tree spatial indexes of the node positions and of the way bounding boxes
+SPATIAL_INDEX_SQL = ['CREATE VIRTUAL TABLE nodes_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);',
+                     'CREATE VIRTUAL TABLE ways_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);']
+
+SPATIAL_INDEX_FILL_SQL = ['INSERT INTO nodes_rtree SELECT id, lat, lat, lon, lon FROM nodes;',
+                          '''INSERT INTO ways_rtree
+                             SELECT w.id, MIN(n.lat), MAX(n.lat), MIN(n.lon), MAX(n.lon)
+                             FROM ways_nodes w JOIN nodes n ON n.id = w.node_id GROUP BY w.id;''']
+
+# keep the spatial indexes up to date when elements are inserted or deleted after the load (osc_to_db).
+# a way box grows with every inserted way node, the box of a way is rebuilt when its way nodes are replaced,
+# not when one of its nodes moves
+SPATIAL_INDEX_TRIGGERS_SQL = ['''
+CREATE TRIGGER nodes_rtree_insert AFTER INSERT ON nodes
+BEGIN
+    INSERT OR REPLACE INTO nodes_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+END;''', '''
+CREATE TRIGGER nodes_rtree_delete AFTER DELETE ON nodes
+BEGIN
+    DELETE FROM nodes_rtree WHERE id = OLD.id;
+END;''', '''
+CREATE TRIGGER ways_rtree_insert AFTER INSERT ON ways_nodes
+BEGIN
+    INSERT OR REPLACE INTO ways_rtree
+    SELECT NEW.id, MIN(lat), MAX(lat), MIN(lon), MAX(lon) FROM (
+        SELECT lat, lon FROM nodes WHERE id = NEW.node_id
+        UNION ALL SELECT min_lat, min_lon FROM ways_rtree WHERE id = NEW.id
+        UNION ALL SELECT max_lat, max_lon FROM ways_rtree WHERE id = NEW.id)
+    HAVING COUNT(*) > 0;
+END;''', '''
+CREATE TRIGGER ways_rtree_delete AFTER DELETE ON ways_nodes
+BEGIN
+    DELETE FROM ways_rtree WHERE id = OLD.id;
+END;''']
+
+# normalized layout (see normalize_tables): the (uid, user) pairs move to users, the tag keys and types to tag_keys
+# and the values of the tag keys with few distinct values to tag_values
+USER_TABLES = ['nodes', 'ways', 'relations']
+
+USERS_SQL = 'CREATE TABLE users (user_id INTEGER PRIMARY KEY, uid INTEGER, user TEXT, UNIQUE (uid, user));'
+TAG_KEYS_SQL = ('CREATE TABLE tag_keys (key_id INTEGER PRIMARY KEY, key TEXT, type TEXT, interned INTEGER, '
+                'UNIQUE (key, type));')
+TAG_VALUES_SQL = 'CREATE TABLE tag_values (value_id INTEGER PRIMARY KEY, value TEXT UNIQUE);'
+
+# the tag values of a key are interned when it has at most this many distinct values
+INTERNED_VALUES_MAX = 1000
+
+# geometry of the ways, materialized from the node store by node_store.load_ways_geom
+WAYS_GEOM_SQL = ('CREATE TABLE ways_geom (id INTEGER PRIMARY KEY, node_count INTEGER, missing_nodes INTEGER, '
+                 'min_lat REAL, min_lon REAL, max_lat REAL, max_lon REAL, length REAL, coordinates BLOB);')
+WAYS_GEOM_INSERT_SQL = 'INSERT INTO ways_geom VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);'
+
+
+def table_columns(table):
+    """Return the columns of the table"""
+    return dict((name, columns) for name, _, columns in TABLES)[table]
+
+
+def column_types(table):
+    """Return the sql type of every column of the table, read from schema.py unless the column is converted"""
+    key = dict((name, key) for name, key, _ in TABLES)[table]
+    rules = schema.schema[key]
+
+    # list of dicts (tags, way nodes) or single dict (node, way)
+    fields = rules['schema']['schema'] if rules['type'] == 'list' else rules['schema']
+
+    types = []
+    for column in table_columns(table):
+        if column in COLUMN_CONVERSIONS:
+            types.append((column, COLUMN_CONVERSIONS[column][0]))
+        else:
+            types.append((column, SQL_TYPES[fields[column]['type']]))
+
+    return types
+
+
+def load_converter(table):
+    """Return a function converting a row of the table from its csv values to its stored values,
+    None when no column of the table is converted
+    """
+    conversions = [(i, COLUMN_CONVERSIONS[column][1]) for i, column in enumerate(table_columns(table))
+                   if column in COLUMN_CONVERSIONS]
+    if not conversions:
+        return None
+
+    def convert(row):
+        row = list(row)
+        for i, conversion in conversions:
+            row[i] = conversion(row[i])
+        return row
+    return convert
+
+
+def create_table_sql(table):
+    """Return the CREATE TABLE statement of the table"""
+    primary_key = PRIMARY_KEYS.get(table, [])
+    columns = []
+
+    for column, sqlType in column_types(table):
+        if primary_key == [column] and sqlType == 'INTEGER':
+            sqlType += ' PRIMARY KEY'
+        columns.append('{0} {1}'.format(column, sqlType))
+
+    sql = 'CREATE TABLE {0} ({1}'.format(table, ', '.join(columns))
+    if len(primary_key) > 1:
+        sql += ', PRIMARY KEY ({0})) WITHOUT ROWID'.format(', '.join(primary_key))
+    else:
+        sql += ')'
+
+    return sql + ';'
+
+
+def insert_sql(table, verb='INSERT'):
+    """Return the INSERT statement (or another verb like INSERT OR REPLACE) of the table with one parameter per column"""
+    columns = table_columns(table)
+    return '{0} INTO {1} ({2}) VALUES ({3});'.format(verb, table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+
+def create_tables(cur, tables=None):
+    """Drop then create the map tables, and drop the ways_geom of the former ones"""
+    drop_normalized_tables(cur)
+    cur.execute('DROP TABLE IF EXISTS ways_geom')
+    for table in tables or [name for name, _, _ in TABLES]:
+        cur.execute('DROP TABLE IF EXISTS ' + table)
+        cur.execute(create_table_sql(table))
+
+
+def layout_indexes(cur):
+    """Return the (name, table, columns) of the INDEXES of the database layout.
+    In a normalized database the indexes of nodes, ways and relations are on their data tables and
+    the tags tables views are skipped, normalize_tables gives their data tables indexes of their own.
+    The indexes of the other tables (ways_nodes, relations_members) are unchanged.
+    """
+    if not is_normalized(cur):
+        return INDEXES
+
+    return [(name, table + '_data' if table in USER_TABLES else table, columns)
+            for name, table, columns in INDEXES if table not in TAGS_TABLES]
+
+
+def create_indexes(cur):
+    """Build the indexes once the tables are loaded, then refresh the query planner statistics"""
+    for name, table, columns in layout_indexes(cur):
+        cur.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2});'.format(name, table, ', '.join(columns)))
+    cur.execute('ANALYZE;')
+
+
+def build_tag_summary(cur):
+    """Compute tag_summary from the loaded tags tables then install the triggers keeping it up to date"""
+    cur.execute('DROP TABLE IF EXISTS tag_summary')
+    cur.execute(TAG_SUMMARY_SQL)
+
+    for table in TAGS_TABLES:
+        cur.execute('''INSERT INTO tag_summary
+                       SELECT '{0}', key, value, COUNT(DISTINCT id) FROM {0} GROUP BY key, value;'''.format(table))
+
+        for trigger in TAG_SUMMARY_TRIGGERS_SQL:
+            cur.execute(trigger.format(table))
+
+    cur.execute(TAG_SUMMARY_INDEX_SQL)
+
+
+def build_spatial_index(cur):
+    """Build the R*Tree indexes of the loaded nodes and ways then install the triggers keeping them up to date"""
+    for table in ('nodes_rtree', 'ways_rtree'):
+        cur.execute('DROP TABLE IF EXISTS ' + table)
+
+    for sql in SPATIAL_INDEX_SQL + SPATIAL_INDEX_FILL_SQL + SPATIAL_INDEX_TRIGGERS_SQL:
+        cur.execute(sql)
+
+
+def drop_indexes(cur):
+    """Drop the indexes built by create_indexes"""
+    for name, _, _ in layout_indexes(cur):
+        cur.execute('DROP INDEX IF EXISTS ' + name)
+
+
+def is_normalized(cur):
+    """Tell whether the map tables of the database have the normalized layout of normalize_tables"""
+    return cur.execute("SELECT type FROM sqlite_master WHERE name = 'nodes';").fetchone() == ('view',)
+
+
+def normalize_tables(cur, interned_values_max=INTERNED_VALUES_MAX):
+    """Move the loaded map tables to the normalized layout, which repeats no user name, tag key or common value:
+
+        users(user_id, uid, user): every (uid, user) pair, a renamed uid has one row per name
+        tag_keys(key_id, key, type, interned)
+        tag_values(value_id, value): the values of the keys with at most interned_values_max distinct values
+        <table>_data: nodes, ways and relations with the user_id of their (uid, user) instead of their user,
+                      tags tables with key_id and either value_id (interned) or value
+
+    Views named like the former tables join them back, so the existing queries keep working.
+    The tag_summary and the spatial indexes are kept, their triggers are dropped with the former tables:
+    a normalized database is read only.
+    """
+    users = ' UNION '.join('SELECT uid, user FROM ' + table for table in USER_TABLES)
+    cur.execute('DROP TABLE IF EXISTS users')
+    cur.execute(USERS_SQL)
+    cur.execute('INSERT INTO users (uid, user) {0};'.format(users))
+
+    for table in USER_TABLES:
+        columns = table_columns(table)
+        data_columns = [(column, sqlType + (' PRIMARY KEY' if column == 'id' else ''))
+                        for column, sqlType in column_types(table) if column != 'user']
+
+        cur.execute('DROP TABLE IF EXISTS {0}_data'.format(table))
+        cur.execute('CREATE TABLE {0}_data ({1}, user_id INTEGER);'.format(
+            table, ', '.join('{0} {1}'.format(column, sqlType) for column, sqlType in data_columns)))
+        cur.execute('''INSERT INTO {0}_data SELECT {1}, u.user_id
+                       FROM {0} t LEFT JOIN users u ON u.uid IS t.uid AND u.user IS t.user;'''.format(
+            table, ', '.join('t.' + column for column, _ in data_columns)))
+        cur.execute('DROP TABLE ' + table)
+        cur.execute('CREATE VIEW {0} AS SELECT {1} FROM {0}_data d LEFT JOIN users u ON u.user_id = d.user_id;'.format(
+            table, ', '.join('u.user' if column == 'user' else 'd.' + column for column in columns)))
+
+        # the indexes of the former table move to its data table
+        for name, indexed, index_columns in INDEXES:
+            if indexed == table:
+                cur.execute('CREATE INDEX {0} ON {1}_data ({2});'.format(name, table, ', '.join(index_columns)))
+
+    tags = ' UNION ALL '.join('SELECT key, type, value FROM ' + table for table in TAGS_TABLES)
+    cur.execute('DROP TABLE IF EXISTS tag_keys')
+    cur.execute(TAG_KEYS_SQL)
+    cur.execute('INSERT INTO tag_keys (key, type, interned) '
+                'SELECT key, type, COUNT(DISTINCT value) <= ? FROM ({0}) GROUP BY key, type;'.format(tags),
+                (interned_values_max,))
+
+    cur.execute('DROP TABLE IF EXISTS tag_values')
+    cur.execute(TAG_VALUES_SQL)
+    cur.execute('INSERT INTO tag_values (value) SELECT DISTINCT t.value FROM ({0}) t '
+                'JOIN tag_keys k ON k.key = t.key AND k.type = t.type WHERE k.interned;'.format(tags))
+
+    for table in TAGS_TABLES:
+        cur.execute('DROP TABLE IF EXISTS {0}_data'.format(table))
+        cur.execute('CREATE TABLE {0}_data (id INTEGER, key_id INTEGER, value_id INTEGER, value TEXT);'.format(table))
+        # inserted in the former row order, so the tags of an element stay together
+        cur.execute('''INSERT INTO {0}_data
+                       SELECT t.id, k.key_id, v.value_id, CASE WHEN v.value_id IS NULL THEN t.value END
+                       FROM {0} t JOIN tag_keys k ON k.key = t.key AND k.type = t.type
+                       LEFT JOIN tag_values v ON k.interned AND v.value = t.value
+                       ORDER BY t.rowid;'''.format(table))
+        cur.execute('DROP TABLE ' + table)
+        cur.execute('''CREATE VIEW {0} AS
+                       SELECT d.id, k.key, COALESCE(v.value, d.value) AS value, k.type
+                       FROM {0}_data d JOIN tag_keys k ON k.key_id = d.key_id
+                       LEFT JOIN tag_values v ON v.value_id = d.value_id;'''.format(table))
+        cur.execute('CREATE INDEX {0}_data_key_value ON {0}_data (key_id, value_id, value);'.format(table))
+        cur.execute('CREATE INDEX {0}_data_id ON {0}_data (id);'.format(table))
+
+    cur.execute('ANALYZE;')
+
+
+def drop_normalized_tables(cur):
+    """Drop the views and the tables of the normalized layout, if the database has it"""
+    if not is_normalized(cur):
+        return
+
+    for table in USER_TABLES + TAGS_TABLES:
+        cur.execute('DROP VIEW IF EXISTS ' + table)
+        cur.execute('DROP TABLE IF EXISTS {0}_data'.format(table))
+    for table in ('users', 'tag_keys', 'tag_values'):
+        cur.execute('DROP TABLE IF EXISTS ' + table)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script synthesizes larger OSM files from riyadh_sample.osm, to measure how the wrangling scripts scale.
+Every synthetic element copies the attributes and tags of a random element of the sample (its template),
+so the tag keys and values keep the distribution of the sample:
+nodes are moved around their template position, ways reference as many consecutive nodes as their template
+and relations reference random synthetic elements of the member types of their template.
+The file is written element by element, with compression when its name ends with .bz2, .gz or .xz.
+"""
+
+import argparse
+import bz2
+import gzip
+import io
+import random
+import xml.etree.cElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+import osm_input
+
+SAMPLE_PATH = 'riyadh_sample.osm'
+
+# standard deviation in degrees of the move of a node around its template position
+JITTER = 0.002
+
+ATTRIBUTES = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+
+OSM_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="generate_osm.py">\n'
+OSM_FOOTER = '</osm>\n'
+
+
+def read_templates(sample_path=SAMPLE_PATH):
+    """Return the templates of the sample by element tag: (attributes, (k, v) tags, nd count or members)"""
+    templates = {'node': [], 'way': [], 'relation': []}
+
+    for _, elem in ET.iterparse(sample_path):
+        if elem.tag in templates:
+            tags = [(tag.attrib['k'], tag.attrib['v']) for tag in elem.iter('tag')]
+            if elem.tag == 'way':
+                children = len(elem.findall('nd'))
+            else:
+                children = [(member.attrib['type'], member.attrib['role']) for member in elem.iter('member')]
+
+            templates[elem.tag].append((dict(elem.attrib), tags, children))
+            elem.clear()
+
+    return templates
+
+
+def element_xml(tag, attrib, tags, children=()):
+    """Return the XML lines of an element, its attributes in the usual OSM order"""
+    attributes = u' '.join(u'{0}={1}'.format(name, quoteattr(attrib[name])) for name in ATTRIBUTES if name in attrib)
+    lines = [u'\t\t{0}\n'.format(child) for child in children]
+    lines += [u'\t\t<tag k={0} v={1} />\n'.format(quoteattr(k), quoteattr(v)) for k, v in tags]
+
+    if not lines:
+        return u'\t<{0} {1} />\n'.format(tag, attributes)
+    return u'\t<{0} {1}>\n{2}\t</{0}>\n'.format(tag, attributes, u''.join(lines))
+
+
+def open_output(path):
+    """Open the output file for binary writing, compressed according to its extension"""
+    compression = osm_input.compression(path)
+    if compression == '.bz2':
+        return bz2.BZ2File(path, 'wb')
+    if compression == '.gz':
+        return gzip.open(path, 'wb')
+    if compression == '.xz':
+        if osm_input.lzma is None:
+            raise ValueError(".xz files need the lzma module (backports.lzma on python 2)")
+        return osm_input.lzma.LZMAFile(path, 'wb')
+    return io.open(path, 'wb')
+
+
+def generate(out_path, scale, sample_path=SAMPLE_PATH, seed=0):
+    """Write an OSM file with scale times the elements of the sample and return the number of elements by tag"""
+    rng = random.Random(seed)
+    templates = read_templates(sample_path)
+    counts = dict((tag, int(round(len(elements) * scale))) for tag, elements in templates.items())
+
+    def write(text):
+        out.write(text.encode('utf-8') if isinstance(text, type(u'')) else text)
+
+    out = open_output(out_path)
+    try:
+        write(OSM_HEADER)
+
+        for node_id in range(1, counts['node'] + 1):
+            attrib, tags, _ = rng.choice(templates['node'])
+            attrib = dict(attrib, id=str(node_id),
+                          lat='{0:.7f}'.format(float(attrib['lat']) + rng.gauss(0, JITTER)),
+                          lon='{0:.7f}'.format(float(attrib['lon']) + rng.gauss(0, JITTER)))
+            write(element_xml('node', attrib, tags))
+
+        for way_id in range(1, counts['way'] + 1):
+            attrib, tags, nd_count = rng.choice(templates['way'])
+            first = rng.randint(1, max(counts['node'] - nd_count + 1, 1))
+            refs = ['<nd ref="{0}" />'.format(ref) for ref in range(first, first + nd_count)]
+            write(element_xml('way', dict(attrib, id=str(way_id)), tags, refs))
+
+        for relation_id in range(1, counts['relation'] + 1):
+            attrib, tags, members = rng.choice(templates['relation'])
+            members = [u'<member type="{0}" ref="{1}" role={2} />'.format(
+                member_type, rng.randint(1, max(counts.get(member_type, 0), 1)), quoteattr(role))
+                for member_type, role in members]
+            write(element_xml('relation', dict(attrib, id=str(relation_id)), tags, members))
+
+        write(OSM_FOOTER)
+    finally:
+        out.close()
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('out_path', help="synthetic OSM file to write (.bz2, .gz and .xz are compressed)")
+    parser.add_argument('--scale', type=float, default=10, help="elements of the synthetic file per sample element")
+    parser.add_argument('--sample', default=SAMPLE_PATH, help="OSM file giving the element templates")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random choices")
+    args = parser.parse_args()
+
+    counts = generate(args.out_path, args.scale, args.sample, args.seed)
+    print('{0}: {1[node]} nodes, {1[way]} ways, {1[relation]} relations'.format(args.out_path, counts))
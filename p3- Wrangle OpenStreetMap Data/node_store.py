@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script keeps the node coordinates in a compact on-disk store and materializes the way geometries from it.
+The store is a directory of three numpy arrays, memory mapped when read:
+
+    ids.npy:  the node ids, sorted int64
+    lat.npy:  the latitudes, int32 fixed point (1e-7 degree, the precision of OSM coordinates)
+    lon.npy:  the longitudes, same layout
+
+Node ids are looked up by binary search, a whole array of them at once. The geometry of the ways
+(node count, bounding box, length and coordinates) is computed in vectorized passes over ways_nodes.csv
+and loaded into the ways_geom table. numpy is needed by this script only.
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sqlite3
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import db_schema
+
+NODES_PATH = 'nodes.csv'
+WAY_NODES_PATH = 'ways_nodes.csv'
+
+# fixed point unit of the coordinates, in degrees
+SCALE = 10 ** 7
+
+# csv rows read per vectorized pass
+CHUNK_SIZE = 1 << 20
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+
+def require_numpy():
+    if np is None:
+        raise ValueError("the node store needs numpy")
+
+
+def store_paths(store_dir):
+    """Return the paths of the ids, lat and lon arrays of the store"""
+    return [os.path.join(store_dir, name + '.npy') for name in ('ids', 'lat', 'lon')]
+
+
+def build_node_store(store_dir, nodes_path=NODES_PATH, chunk_size=CHUNK_SIZE):
+    """Fill the node store from the id, lat and lon columns of nodes.csv and return the number of nodes.
+    The columns are appended chunk by chunk to raw files, which are then sorted by id into the store arrays,
+    so only the sort permutation is held in memory (none when the nodes are already sorted, as in OSM files).
+    """
+    require_numpy()
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    paths = store_paths(store_dir)
+    raw_paths = [path + '.tmp' for path in paths]
+    raw_files = [open(path, 'wb') for path in raw_paths]
+    count = 0
+
+    try:
+        with open(nodes_path, 'rt') as nodes_file:
+            rows = csv.reader(nodes_file)
+            header = next(rows)
+            columns = [header.index(name) for name in ('id', 'lat', 'lon')]
+
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+
+                np.array([row[columns[0]] for row in chunk], dtype='<i8').tofile(raw_files[0])
+                for raw_file, column in zip(raw_files[1:], columns[1:]):
+                    degrees = np.array([row[column] for row in chunk], dtype=np.float64)
+                    np.round(degrees * SCALE).astype('<i4').tofile(raw_file)
+                count += len(chunk)
+    finally:
+        for raw_file in raw_files:
+            raw_file.close()
+
+    try:
+        raw_ids = np.memmap(raw_paths[0], dtype='<i8', mode='r') if count else np.zeros(0, '<i8')
+        order = None if np.all(raw_ids[1:] > raw_ids[:-1]) else np.argsort(raw_ids, kind='mergesort')
+
+        for raw_path, path, dtype in zip(raw_paths, paths, ('<i8', '<i4', '<i4')):
+            raw = np.memmap(raw_path, dtype=dtype, mode='r') if count else np.zeros(0, dtype)
+            stored = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(count,))
+            stored[:] = raw if order is None else raw[order]
+            stored.flush()
+            del stored, raw
+        del raw_ids
+    finally:
+        for raw_path in raw_paths:
+            os.remove(raw_path)
+
+    return count
+
+
+class NodeStore(object):
+    """Read only node store, its arrays memory mapped"""
+
+    def __init__(self, store_dir):
+        require_numpy()
+        self.ids, self.lat, self.lon = [np.load(path, mmap_mode='r') for path in store_paths(store_dir)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, node_ids):
+        """Return the positions of the node ids in the store arrays and whether every node id was found"""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(len(node_ids), np.intp), np.zeros(len(node_ids), bool)
+
+        positions = np.minimum(np.searchsorted(self.ids, node_ids), len(self.ids) - 1)
+        return positions, self.ids[positions] == node_ids
+
+    def coordinates(self, node_ids):
+        """Return the latitudes and longitudes in degrees of the node ids, NaN for the nodes not found"""
+        return self.degrees(*self.find(node_ids))
+
+    def degrees(self, positions, found):
+        """Return the latitudes and longitudes in degrees at the positions found by find"""
+        lat = np.where(found, self.lat[positions] / float(SCALE), np.nan)
+        lon = np.where(found, self.lon[positions] / float(SCALE), np.nan)
+        return lat, lon
+
+
+def way_node_chunks(way_nodes_path=WAY_NODES_PATH, chunk_size=CHUNK_SIZE):
+    """Yield the (way ids, node ids) arrays of ways_nodes.csv by chunks of whole ways.
+    The rows of a way follow each other in the order of their positions, as xml_to_csv writes them.
+    """
+    with open(way_nodes_path, 'rt') as way_nodes_file:
+        rows = csv.reader(way_nodes_file)
+        header = next(rows)
+        columns = [header.index(name) for name in ('id', 'node_id')]
+        pending = np.zeros((0, 2), dtype=np.int64)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            pairs = np.array([(row[columns[0]], row[columns[1]]) for row in chunk], dtype=np.int64)
+            pairs = np.concatenate((pending, pairs))
+
+            # the rows of the last way may go on in the next chunk
+            others = pairs[:, 0] != pairs[-1, 0]
+            last = len(pairs) - np.argmax(others[::-1]) if others.any() else 0
+            pending = pairs[last:]
+            if last:
+                yield pairs[:last, 0], pairs[:last, 1]
+
+        if len(pending):
+            yield pending[:, 0], pending[:, 1]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Return the great circle distances in meters between the arrays of points, in degrees"""
+    lat1, lon1, lat2, lon2 = [np.radians(values) for values in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def way_geometries(store, way_nodes_path=WAY_NODES_PATH, chunk_size=CHUNK_SIZE):
+    """Yield the ways_geom rows of the ways: id, node_count, missing_nodes, min_lat, min_lon, max_lat, max_lon,
+    length (meters, over the consecutive nodes found) and coordinates (little endian int32 fixed point
+    lat, lon pairs of the nodes found). The bounding box of a way without any node found is NULL.
+    """
+    for way_ids, node_ids in way_node_chunks(way_nodes_path, chunk_size):
+        positions, found = store.find(node_ids)
+        lat, lon = store.degrees(positions, found)
+
+        starts = np.flatnonzero(np.r_[True, way_ids[1:] != way_ids[:-1]])
+        ends = np.r_[starts[1:], len(way_ids)]
+        counts = ends - starts
+        missing = counts - np.add.reduceat(found.astype(np.int64), starts)
+
+        with np.errstate(invalid='ignore'):
+            boxes = [reduce_way.reduceat(values, starts) for reduce_way, values in
+                     ((np.fmin, lat), (np.fmin, lon), (np.fmax, lat), (np.fmax, lon))]
+
+        # segment i joins the nodes i and i + 1 of the same way, missing nodes break the way
+        segments = np.zeros(len(way_ids))
+        if len(way_ids) > 1:
+            joined = (way_ids[1:] == way_ids[:-1]) & found[1:] & found[:-1]
+            distances = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+            segments[:-1] = np.where(joined, distances, 0.0)
+        lengths = np.add.reduceat(segments, starts)
+
+        points = np.column_stack((store.lat[positions], store.lon[positions])).astype('<i4')
+
+        columns = [way_ids[starts].tolist(), counts.tolist(), missing.tolist()]
+        columns += [[None if value != value else value for value in box.tolist()] for box in boxes]
+        columns.append(lengths.tolist())
+
+        for i, row in enumerate(zip(*columns)):
+            start, end = starts[i], ends[i]
+            coordinates = points[start:end][found[start:end]].tobytes()
+            yield row + (sqlite3.Binary(coordinates),)
+
+
+def load_ways_geom(cur, store, way_nodes_path=WAY_NODES_PATH, chunk_size=CHUNK_SIZE):
+    """Create the ways_geom table and fill it with the geometries of the ways, return the number of ways"""
+    cur.execute('DROP TABLE IF EXISTS ways_geom')
+    cur.execute(db_schema.WAYS_GEOM_SQL)
+
+    total = 0
+    rows = way_geometries(store, way_nodes_path, chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        cur.executemany(db_schema.WAYS_GEOM_INSERT_SQL, chunk)
+        total += len(chunk)
+
+    return total
+
+
+def decode_coordinates(blob):
+    """Return the (lat, lon) degrees of a ways_geom coordinates blob"""
+    require_numpy()
+    points = np.frombuffer(bytes(blob), dtype='<i4').reshape(-1, 2) / float(SCALE)
+    return [tuple(point) for point in points.tolist()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store_dir', help="directory of the node store")
+    parser.add_argument('--nodes', default=NODES_PATH, help="nodes csv file the store is built from")
+    parser.add_argument('--db', help="also load the way geometries into the ways_geom table of this database")
+    parser.add_argument('--ways-nodes', default=WAY_NODES_PATH, help="ways nodes csv file of the geometries")
+    args = parser.parse_args()
+
+    print('{0}: {1} nodes stored'.format(args.store_dir, build_node_store(args.store_dir, args.nodes)))
+
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        try:
+            ways = load_ways_geom(conn.cursor(), NodeStore(args.store_dir), args.ways_nodes)
+            conn.commit()
+        finally:
+            conn.close()
+        print('{0}: {1} way geometries loaded'.format(args.db, ways))
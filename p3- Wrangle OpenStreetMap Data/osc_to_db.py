@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script applies an OSM change file (.osc) to an existing map database instead of reloading everything.
+Created and modified elements are shaped with xml_to_csv.shape_element and replace their rows,
+deleted elements are removed, the dependent tags and way nodes rows included.
+The ways_geom rows of the changed ways and of the ways of the changed nodes are deleted, not recomputed:
+reload the way geometries with node_store.py to get them back.
+A database converted with --clean should be updated with --clean too, so the new tag values are cleaned alike.
+"""
+
+import argparse
+import sqlite3
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+
+import cerberus
+
+import clean_cache
+import db_schema
+import osm_input
+import xml_to_csv
+
+DB_NAME = 'RiyadhMapDB.db'
+
+# element tag: main table, then the dependent tables with the shaped element key of their rows
+ELEMENT_TABLES = {'node': ('nodes', [('nodes_tags', 'node_tags')]),
+                  'way': ('ways', [('ways_nodes', 'way_nodes'), ('ways_tags', 'way_tags')]),
+                  'relation': ('relations', [('relations_members', 'relation_members'),
+                                             ('relations_tags', 'relation_tags')])}
+
+
+def get_changes(osc_file):
+    """Yield (action, element) for every element of the create, modify and delete blocks.
+    Compressed change files (like the .osc.gz replication diffs) are decompressed on the fly.
+    """
+    depth = 0
+    action = None
+
+    with osm_input.osm_input(osc_file) as stream:
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                if depth == 1:
+                    action = elem
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 2:
+                    yield action.tag, elem
+                    action.clear()
+
+
+def delete_geometries(cur, tag, element_id):
+    """Delete the ways_geom rows made stale by a change of the node or the way"""
+    if tag == 'way':
+        cur.execute('DELETE FROM ways_geom WHERE id = ?;', (element_id,))
+    elif tag == 'node':
+        cur.execute('DELETE FROM ways_geom WHERE id IN (SELECT id FROM ways_nodes WHERE node_id = ?);', (element_id,))
+
+
+def delete_element(cur, tag, element_id):
+    """Delete the element row and its dependent rows"""
+    table, dependents = ELEMENT_TABLES[tag]
+
+    for dependent, _ in dependents:
+        cur.execute('DELETE FROM {0} WHERE id = ?;'.format(dependent), (element_id,))
+    cur.execute('DELETE FROM {0} WHERE id = ?;'.format(table), (element_id,))
+
+
+def upsert_element(cur, tag, el):
+    """Replace the element row and all its dependent rows by the shaped element ones"""
+    table, dependents = ELEMENT_TABLES[tag]
+    element_id = el[tag]['id']
+
+    for dependent, _ in dependents:
+        cur.execute('DELETE FROM {0} WHERE id = ?;'.format(dependent), (element_id,))
+
+    row = [el[tag][column] for column in db_schema.table_columns(table)]
+    convert = db_schema.load_converter(table)
+    cur.execute(db_schema.insert_sql(table, 'INSERT OR REPLACE'), convert(row) if convert else row)
+
+    for dependent, key in dependents:
+        columns = db_schema.table_columns(dependent)
+        cur.executemany(db_schema.insert_sql(dependent), [[row[column] for column in columns] for row in el[key]])
+
+
+def apply_changes(osc_file, db_name=DB_NAME, validate=False, cleaner=None):
+    """Apply the OSM change file to the database in a single transaction.
+    cleaner(key, value), if given, cleans the tag values (see clean_cache.CleaningCache).
+    Returns the number of applied changes by (action, element tag).
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+    if db_schema.is_normalized(cur):
+        conn.close()
+        raise ValueError("{0} has the read only normalized layout, reload it without --normalized "
+                         "to apply changes".format(db_name))
+    validator = cerberus.Validator()
+    counts = defaultdict(int)
+    geometries = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'ways_geom';").fetchone() is not None
+
+    try:
+        for action, element in get_changes(osc_file):
+            if element.tag not in ELEMENT_TABLES:
+                continue
+
+            # the geometry of a changed way or of the ways of a changed node is stale
+            if geometries:
+                delete_geometries(cur, element.tag, element.attrib['id'])
+
+            if action == 'delete':
+                delete_element(cur, element.tag, element.attrib['id'])
+            else:
+                el = xml_to_csv.shape_element(element, cleaner=cleaner)
+                if validate is True:
+                    xml_to_csv.validate_element(el, validator)
+                upsert_element(cur, element.tag, el)
+
+            counts[(action, element.tag)] += 1
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('osc_file', help="OSM change file to apply, .bz2, .gz and .xz files are decompressed on the fly")
+    parser.add_argument('--db', default=DB_NAME, help="database file name")
+    parser.add_argument('--validate', action='store_true', help="validate the shaped elements against the schema")
+    parser.add_argument('--clean', action='store_true', help="clean the street names and phone numbers")
+    parser.add_argument('--clean-cache-size', type=int, default=clean_cache.CACHE_SIZE,
+                        help="entries of the cleaning LRU cache")
+    parser.add_argument('--clean-cache', help="json file keeping the cleaning cache between runs")
+    args = parser.parse_args()
+
+    cleaner = None
+    if args.clean:
+        cleaner = clean_cache.CleaningCache(xml_to_csv.cleanTagValue, xml_to_csv.CLEANED_KEYS,
+                                            args.clean_cache_size, args.clean_cache)
+
+    for (action, tag), count in sorted(apply_changes(args.osc_file, args.db, args.validate, cleaner).items()):
+        print('{0} {1}: {2}'.format(action, tag, count))
+
+    if cleaner:
+        print(cleaner.stats())
+        if args.clean_cache:
+            cleaner.save()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script holds the element filters applied by the parser backends of osm_parsers while they read the map.
+The type, timestamp and bounding box conditions only need the attributes of an element, so they are checked
+before its parts are read. Only the expat backend checks them as soon as the element starts and does not even
+collect the children of a rejected element, etree and lxml have built the whole element by then.
+The tag key and way node conditions are checked once the element is complete.
+"""
+
+
+class ElementFilter(object):
+    """Conditions an element must meet to be kept, every condition left to None is not checked.
+
+    types:     element tags kept ('node', 'way', 'relation')
+    bbox:      (min lat, min lon, max lat, max lon) of the nodes kept
+    since:     first timestamp kept, an ISO date or date-time like 2015-01-01 or 2015-01-01T12:00:00Z
+    until:     first timestamp not kept anymore
+    keys:      tag keys, an element is kept when it has at least one of them
+    way_nodes: 'any' keeps the ways referencing at least one kept node, 'all' the ways referencing only kept nodes.
+               The ids of the kept nodes are held in memory, so the nodes must come before the ways (as in OSM files)
+               and the whole map must be read by the same filter.
+    """
+
+    def __init__(self, types=None, bbox=None, since=None, until=None, keys=None, way_nodes=None):
+        if way_nodes not in (None, 'any', 'all'):
+            raise ValueError("way_nodes must be 'any' or 'all', not {0!r}".format(way_nodes))
+
+        self.types = frozenset(types) if types else None
+        self.bbox = tuple(float(coordinate) for coordinate in bbox) if bbox else None
+        self.since = since
+        self.until = until
+        self.keys = frozenset(keys) if keys else None
+        self.way_nodes = way_nodes
+        self.kept_nodes = set() if way_nodes else None
+
+    def accept_start(self, tag, attrib):
+        """Check the conditions on the element attributes"""
+        if self.types is not None and tag not in self.types:
+            return False
+
+        # ISO timestamps of the same format sort like the dates they represent
+        if self.since is not None and attrib.get('timestamp', '') < self.since:
+            return False
+        if self.until is not None and attrib.get('timestamp', '') >= self.until:
+            return False
+
+        if self.bbox is not None and tag == 'node':
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            if not (min_lat <= float(attrib['lat']) <= max_lat and min_lon <= float(attrib['lon']) <= max_lon):
+                return False
+
+        return True
+
+    def accept(self, tag, attrib, tags, refs):
+        """Check the conditions on the complete element, remembering the kept nodes for the way condition"""
+        if self.keys is not None and not any(k in self.keys for k, _ in tags):
+            return False
+
+        if tag == 'way' and self.way_nodes:
+            condition = any if self.way_nodes == 'any' else all
+            if not condition(int(ref) in self.kept_nodes for ref in refs):
+                return False
+
+        if tag == 'node' and self.kept_nodes is not None:
+            self.kept_nodes.add(int(attrib['id']))
+
+        return True
+
+
+def add_arguments(parser):
+    """Add the filter options to an argparse parser"""
+    group = parser.add_argument_group('filters')
+    group.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                       help="keep the nodes in the bounding box")
+    group.add_argument('--keys', nargs='+', metavar='KEY', help="keep the elements having one of the tag keys")
+    group.add_argument('--types', nargs='+', choices=['node', 'way', 'relation'], help="keep the elements of the types")
+    group.add_argument('--since', help="keep the elements last edited at or after this ISO date")
+    group.add_argument('--until', help="keep the elements last edited before this ISO date")
+    group.add_argument('--way-nodes', choices=['any', 'all'],
+                       help="keep the ways referencing any or only kept nodes")
+
+
+def from_arguments(args):
+    """Return the ElementFilter of the parsed filter options, None when there is no filter"""
+    options = dict(types=args.types, bbox=args.bbox, since=args.since, until=args.until, keys=args.keys,
+                   way_nodes=args.way_nodes)
+
+    if not any(value is not None for value in options.values()):
+        return None
+    return ElementFilter(**options)
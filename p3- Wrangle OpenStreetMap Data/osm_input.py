@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script opens OSM files for the parsers, compressed extracts (.osm.bz2, .osm.gz, .osm.xz) included.
+A compressed file is decompressed by a background thread feeding the parser through a bounded queue,
+so decompression overlaps with parsing and the decompressed map is never written to disk.
+"""
+
+import bz2
+import contextlib
+import os
+import threading
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# compressed bytes read at once
+READ_SIZE = 1 << 20
+
+# decompressed blocks waiting for the parser, bounds the memory used ahead of the parser
+QUEUE_SIZE = 16
+
+# extension: function creating a decompressor of one stream, None when its module is missing
+DECOMPRESSORS = {'.bz2': bz2.BZ2Decompressor,
+                 '.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                 '.xz': lzma.LZMADecompressor if lzma else None}
+
+
+def compression(path):
+    """Return the compression extension of the file name, None for an uncompressed file"""
+    extension = os.path.splitext(path)[1].lower()
+    return extension if extension in DECOMPRESSORS else None
+
+
+def decompress_blocks(raw, new_decompressor, read_size=READ_SIZE):
+    """Yield the decompressed blocks of the raw file object.
+    Files made of several concatenated streams (pbzip2, multi-member gzip) are read to the end.
+    """
+    decompressor = new_decompressor()
+
+    while True:
+        data = raw.read(read_size)
+        if not data:
+            break
+
+        while data:
+            try:
+                yield decompressor.decompress(data)
+            except EOFError:
+                # the previous stream ended exactly at the end of the previous read
+                decompressor = new_decompressor()
+                continue
+
+            # bytes after the end of a stream start the next one
+            data = decompressor.unused_data
+            if data:
+                decompressor = new_decompressor()
+
+
+class DecompressedFile(object):
+    """Read only file object over the decompressed content of a compressed file.
+    A daemon thread decompresses the file into a bounded queue, read() takes the blocks out of it.
+    """
+
+    def __init__(self, path, new_decompressor, queue_size=QUEUE_SIZE):
+        self.name = path
+        self.queue = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.block = b''
+        self.position = 0
+        self.done = False
+
+        self.thread = threading.Thread(target=self._decompress, args=(path, new_decompressor))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _decompress(self, path, new_decompressor):
+        try:
+            with open(path, 'rb') as raw:
+                for block in decompress_blocks(raw, new_decompressor):
+                    if block and not self._put(block):
+                        return
+            self._put(None)
+        except Exception as e:
+            # raised again by read() in the parser thread
+            self._put(e)
+
+    def _put(self, item):
+        """Put the item in the queue unless the file gets closed meanwhile"""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _next_block(self):
+        if self.done:
+            return False
+
+        item = self.queue.get()
+        if item is None or isinstance(item, Exception):
+            self.done = True
+            if item is not None:
+                raise item
+            return False
+
+        self.block, self.position = item, 0
+        return True
+
+    def read(self, size=-1):
+        chunks = []
+
+        while size != 0:
+            if self.position >= len(self.block) and not self._next_block():
+                break
+
+            end = len(self.block) if size < 0 else self.position + size
+            chunk = self.block[self.position:end]
+            self.position += len(chunk)
+            chunks.append(chunk)
+
+            if size > 0:
+                size -= len(chunk)
+
+        return b''.join(chunks)
+
+    def close(self):
+        """Stop the decompression thread"""
+        self.stopped.set()
+        self.thread.join()
+        self.done = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_osm(path, queue_size=QUEUE_SIZE):
+    """Open the OSM file for binary reading, decompressing it on the fly when it is compressed"""
+    extension = compression(path)
+    if extension is None:
+        return open(path, 'rb')
+
+    if DECOMPRESSORS[extension] is None:
+        raise ValueError("{0} files need the lzma module (backports.lzma on python 2)".format(extension))
+
+    return DecompressedFile(path, DECOMPRESSORS[extension], queue_size)
+
+
+@contextlib.contextmanager
+def osm_input(osm_file):
+    """Give a file object for the OSM file, a path is opened with open_osm and closed on exit,
+    a file object is used as is and left open.
+    """
+    if hasattr(osm_file, 'read'):
+        yield osm_file
+        return
+
+    stream = open_osm(osm_file)
+    try:
+        yield stream
+    finally:
+        stream.close()
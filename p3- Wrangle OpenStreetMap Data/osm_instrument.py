@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script holds the instrumentation of the conversion runs of xml_to_csv.process_map:
+cumulative timers by stage and element type, element and row counters, periodic progress lines
+with the elements/sec and current RSS, and opt-in cProfile and tracemalloc profiling.
+Nothing here runs unless a StageStats is passed to process_map or profiling() is used.
+"""
+
+from collections import defaultdict
+import contextlib
+import cProfile
+import os
+import pstats
+import resource
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+STAGES = ['parse', 'shape', 'clean', 'validate', 'write']
+
+# elements between two checks of the progress clock
+PROGRESS_CHECK = 1000
+
+
+def current_rss_mb():
+    """Current RSS in MB, read from /proc on linux, the peak RSS elsewhere"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024)
+    except (IOError, OSError):
+        unit = 1024.0 * 1024 if sys.platform == 'darwin' else 1024.0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+
+
+class StageStats(object):
+    """Seconds spent by (stage, element tag or cleaned key), elements by tag and rows by csv output.
+    With progress_interval, a progress line is written to out every progress_interval seconds.
+    """
+
+    def __init__(self, progress_interval=None, out=sys.stderr):
+        self.seconds = defaultdict(float)
+        self.elements = defaultdict(int)
+        self.rows = defaultdict(int)
+        self.total = 0
+        self.progress_interval = progress_interval
+        self.out = out
+        self.clock = time.time
+        self.started = self.clock()
+        self.next_progress = self.started + (progress_interval or 0)
+
+    def add(self, stage, tag, seconds):
+        self.seconds[(stage, tag)] += seconds
+
+    def element(self, tag):
+        """Count an element, writing a progress line when it is time to"""
+        self.elements[tag] += 1
+        self.total += 1
+
+        if self.progress_interval and self.total % PROGRESS_CHECK == 0:
+            now = self.clock()
+            if now >= self.next_progress:
+                self.next_progress = now + self.progress_interval
+                self.out.write(self.progress() + '\n')
+                self.out.flush()
+
+    def timed_cleaner(self, cleaner, keys):
+        """Wrap the cleaner(key, value) to time it by tag key, for the keys it cleans"""
+        keys = frozenset(keys)
+
+        def timed(key, value):
+            if key not in keys:
+                return cleaner(key, value)
+
+            begin = self.clock()
+            try:
+                return cleaner(key, value)
+            finally:
+                self.add('clean', key, self.clock() - begin)
+        return timed
+
+    def stage_seconds(self, stage):
+        return sum(seconds for (name, _), seconds in self.seconds.items() if name == stage)
+
+    def progress(self):
+        """Return a one line summary of the run so far"""
+        elapsed = self.clock() - self.started
+        return '{0:>8.1f} s {1:>12} elements {2:>10.0f} elements/s {3:>8.1f} MB RSS'.format(
+            elapsed, self.total, self.total / max(elapsed, 1e-9), current_rss_mb())
+
+    def report(self):
+        """Return the summary lines of the run"""
+        elapsed = max(self.clock() - self.started, 1e-9)
+        tags = sorted(self.elements)
+
+        lines = ['{0:<10}{1:>10}{2:>8}'.format('stage', 'seconds', 'share') +
+                 ''.join('{0:>12}'.format(tag + ' s') for tag in tags)]
+        for stage in STAGES:
+            seconds = self.stage_seconds(stage)
+            line = '{0:<10}{1:>10.3f}{2:>8.1%}'.format(stage, seconds, seconds / elapsed)
+            if stage != 'clean':
+                line += ''.join('{0:>12.3f}'.format(self.seconds[(stage, tag)]) for tag in tags)
+            lines.append(line)
+
+        cleaned = sorted(key for stage, key in self.seconds if stage == 'clean')
+        if cleaned:
+            lines.append('clean (part of shape) by key: ' + ', '.join(
+                '{0} {1:.3f} s'.format(key, self.seconds[('clean', key)]) for key in cleaned))
+
+        lines.append('elements: ' + ', '.join('{0} {1}'.format(tag, self.elements[tag]) for tag in tags))
+        lines.append('rows: ' + ', '.join('{0} {1}'.format(key, self.rows[key]) for key in sorted(self.rows)))
+        lines.append(self.progress())
+        return lines
+
+
+@contextlib.contextmanager
+def profiling(profile_path=None, memory_top=None, out=sys.stderr):
+    """Profile the block with cProfile (stats saved to profile_path, the top functions written to out)
+    and/or trace its allocations with tracemalloc (the memory_top biggest allocation lines written to out).
+    tracemalloc needs python 3.4 or later, it is skipped with a warning otherwise.
+    """
+    profiler = cProfile.Profile() if profile_path else None
+
+    if memory_top and tracemalloc is None:
+        out.write('tracemalloc is not available on python {0}, memory tracing skipped\n'.format(sys.version.split()[0]))
+        memory_top = None
+    if memory_top:
+        tracemalloc.start()
+
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            pstats.Stats(profile_path, stream=out).sort_stats('cumulative').print_stats(20)
+
+        if memory_top:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            out.write('traced memory: {0:.1f} MB current, {1:.1f} MB peak\n'.format(current / 1e6, peak / 1e6))
+            for stat in snapshot.statistics('lineno')[:memory_top]:
+                out.write('{0}\n'.format(stat))
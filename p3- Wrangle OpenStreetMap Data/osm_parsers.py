@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script holds the XML parser backends reading the top level elements of an OSM file.
+Every backend yields the same parts for each element: (tag, attributes, (k, v) tag pairs, children),
+the children being the nd refs of a way and the (type, ref, role) members of a relation,
+ready to be shaped by xml_to_csv.shape_parts. The backends read an open file object,
+iter_parts opens the paths (compressed files included) with osm_input.
+An osm_filters.ElementFilter given to a backend is checked on the attributes of an element
+before its tags and children are read, then on the complete element. Only the expat backend
+skips the children of a rejected element while parsing: etree and lxml build the whole element
+anyway, they only save reading its parts.
+
+    etree: xml.etree.cElementTree.iterparse, builds an Element for every element and child
+    expat: xml.parsers.expat callbacks, collects the parts directly without building any Element
+    lxml:  lxml.etree.iterparse, only available when lxml is installed
+"""
+
+import xml.etree.cElementTree as ET
+from xml.parsers import expat
+
+import osm_input
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+# bytes fed to expat at once
+READ_SIZE = 1 << 16
+
+
+def element_parts(element):
+    """Return the parts of a node, way or relation Element"""
+    tags = [(tag.attrib['k'], tag.attrib['v']) for tag in element.iter('tag')]
+    if element.tag == 'way':
+        refs = [nd.attrib['ref'] for nd in element.iter('nd')]
+    elif element.tag == 'relation':
+        refs = [(member.attrib['type'], member.attrib['ref'], member.attrib['role'])
+                for member in element.iter('member')]
+    else:
+        refs = []
+
+    return (element.tag, element.attrib, tags, refs)
+
+
+def etree_parts(osm_file, tags=ELEMENT_TAGS, element_filter=None):
+    """Yield the parts of the elements with cElementTree, the elements are cleared as soon as they are used"""
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            if element_filter is None:
+                yield element_parts(elem)
+            elif element_filter.accept_start(elem.tag, elem.attrib):
+                parts = element_parts(elem)
+                if element_filter.accept(*parts):
+                    yield parts
+            root.clear()
+
+
+class ExpatHandler(object):
+    """expat callbacks collecting the parts of the top level elements"""
+
+    def __init__(self, tags, element_filter=None):
+        self.tags = frozenset(tags)
+        self.element_filter = element_filter
+        self.depth = 0
+        self.current = None
+        self.parts = []
+
+    def start(self, name, attrib):
+        self.depth += 1
+        if self.depth == 2:
+            if name in self.tags and (self.element_filter is None or
+                                      self.element_filter.accept_start(name, attrib)):
+                self.current = (name, attrib, [], [])
+        elif self.depth == 3 and self.current is not None:
+            if name == 'tag':
+                self.current[2].append((attrib['k'], attrib['v']))
+            elif name == 'nd' and self.current[0] == 'way':
+                self.current[3].append(attrib['ref'])
+            elif name == 'member' and self.current[0] == 'relation':
+                self.current[3].append((attrib['type'], attrib['ref'], attrib['role']))
+
+    def end(self, name):
+        if self.depth == 2 and self.current is not None:
+            if self.element_filter is None or self.element_filter.accept(*self.current):
+                self.parts.append(self.current)
+            self.current = None
+        self.depth -= 1
+
+
+def expat_parts(osm_file, tags=ELEMENT_TAGS, element_filter=None):
+    """Yield the parts of the elements with expat, the file is fed by blocks and nothing but the parts is kept"""
+    handler = ExpatHandler(tags, element_filter)
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+
+    while True:
+        data = osm_file.read(READ_SIZE)
+        parser.Parse(data, not data)
+
+        for parts in handler.parts:
+            yield parts
+        handler.parts = []
+
+        if not data:
+            break
+
+
+def lxml_parts(osm_file, tags=ELEMENT_TAGS, element_filter=None):
+    """Yield the parts of the elements with lxml, the used elements and their previous siblings are removed"""
+    for _, elem in lxml_etree.iterparse(osm_file, events=('end',), tag=ELEMENT_TAGS):
+        if elem.tag in tags and (element_filter is None or element_filter.accept_start(elem.tag, elem.attrib)):
+            tag, attrib, tag_pairs, refs = element_parts(elem)
+            # the attributes are copied since clear() empties them
+            parts = (tag, dict(attrib), tag_pairs, refs)
+            if element_filter is None or element_filter.accept(*parts):
+                yield parts
+
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+PARSERS = {'etree': etree_parts, 'expat': expat_parts}
+if lxml_etree is not None:
+    PARSERS['lxml'] = lxml_parts
+
+DEFAULT_PARSER = 'etree'
+
+
+def iter_parts(osm_file, tags=ELEMENT_TAGS, parser=DEFAULT_PARSER, element_filter=None):
+    """Yield the parts of the elements of the OSM file (a path or a file object) with the parser backend,
+    only the elements accepted by element_filter when it is given.
+    """
+    if parser not in PARSERS:
+        raise ValueError("unknown parser '{0}', available parsers: {1}".format(parser, ', '.join(sorted(PARSERS))))
+
+    return _read_parts(osm_file, tags, PARSERS[parser], element_filter)
+
+
+def _read_parts(osm_file, tags, backend, element_filter):
+    with osm_input.osm_input(osm_file) as stream:
+        for parts in backend(stream, tags, element_filter):
+            yield parts
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script runs a three stage pipeline: read -> work -> write.
+
+    read:  a thread of the main process groups the items of an iterable (the parsed elements) into batches
+    work:  worker processes apply a function to every batch (shaping and validation)
+    write: the main process hands the results to a sink in the original batch order
+
+The stages are connected by bounded queues and at most max_batches batches are in flight,
+so a slow stage blocks the previous ones instead of letting the memory grow.
+Every stage counts its items and the time it spends busy or waiting, showing which stage is the bottleneck.
+"""
+
+import multiprocessing
+import pickle
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# items per batch sent to the workers
+BATCH_SIZE = 500
+
+# batches waiting in each queue
+QUEUE_SIZE = 8
+
+# seconds between two checks of the stop flag while blocked on a queue
+POLL_INTERVAL = 0.1
+
+
+class StageCounter(object):
+    """Items, batches and seconds spent busy and waiting of a pipeline stage, added up over its threads or processes"""
+
+    def __init__(self, name, parallelism=1):
+        self.name = name
+        self.parallelism = parallelism
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+
+    def add(self, other):
+        self.items += other.items
+        self.batches += other.batches
+        self.busy += other.busy
+        self.waiting += other.waiting
+
+    def report(self, elapsed):
+        """Return a one line summary of the stage over a run of elapsed seconds"""
+        capacity = max(elapsed * self.parallelism, 1e-9)
+        return '{0:<6}{1:>10} items{2:>12.0f} items/s busy   busy {3:>6.1%}   waiting {4:>6.1%}'.format(
+            self.name, self.items, self.items / max(self.busy, 1e-9), self.busy / capacity, self.waiting / capacity)
+
+
+class Pipeline(object):
+    """Pipeline running work(batch) in worker processes over the batches of items and sink(results) in order"""
+
+    def __init__(self, work, sink, workers=None, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.work = work
+        self.sink = sink
+        self.workers = workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.max_batches = 2 * queue_size + self.workers
+
+        self.tasks = multiprocessing.Queue(queue_size)
+        self.results = multiprocessing.Queue(queue_size)
+        self.in_flight = threading.Semaphore(self.max_batches)
+        self.stopped = threading.Event()
+
+        self.counters = [StageCounter('read'), StageCounter('work', self.workers), StageCounter('write')]
+        self.elapsed = 0.0
+        self.read_error = None
+
+    def run(self, items):
+        """Run the pipeline over the items and return the stage counters"""
+        started = time.time()
+
+        reader = threading.Thread(target=self._read, args=(items,))
+        reader.daemon = True
+        processes = [multiprocessing.Process(target=work_batches, args=(self.work, self.tasks, self.results))
+                     for _ in range(self.workers)]
+
+        for process in processes:
+            process.daemon = True
+            process.start()
+        reader.start()
+
+        try:
+            self._write()
+            reader.join()
+            if self.read_error:
+                raise self.read_error
+        except BaseException:
+            self.stopped.set()
+            # wakes up the reader if it waits for a slot
+            self.in_flight.release()
+            self.tasks.cancel_join_thread()
+            for process in processes:
+                process.terminate()
+            raise
+        finally:
+            reader.join()
+            for process in processes:
+                process.join()
+            self.elapsed = time.time() - started
+
+        return self.counters
+
+    def _put(self, item):
+        """Put a task in the queue unless the pipeline gets stopped meanwhile"""
+        while not self.stopped.is_set():
+            try:
+                self.tasks.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _acquire(self):
+        """Wait for a free in flight batch slot, False when the pipeline got stopped meanwhile"""
+        self.in_flight.acquire()
+        return not self.stopped.is_set()
+
+    def _read(self, items):
+        counter = self.counters[0]
+        batch = []
+        sequence = 0
+
+        try:
+            iterator = iter(items)
+            while True:
+                begin = time.time()
+                for item in iterator:
+                    batch.append(item)
+                    if len(batch) == self.batch_size:
+                        break
+                counter.busy += time.time() - begin
+
+                if not batch:
+                    break
+
+                begin = time.time()
+                if not (self._acquire() and self._put((sequence, batch))):
+                    return
+                counter.waiting += time.time() - begin
+
+                counter.items += len(batch)
+                counter.batches += 1
+                sequence += 1
+                batch = []
+        except Exception as e:
+            self.read_error = e
+
+        # one end marker per worker
+        for _ in range(self.workers):
+            self._put((None, None))
+
+    def _write(self):
+        counter = self.counters[2]
+        pending = {}
+        next_sequence = 0
+        finished = 0
+
+        while finished < self.workers:
+            begin = time.time()
+            sequence, payload = self.results.get()
+            counter.waiting += time.time() - begin
+
+            if sequence is None:
+                # a worker is done and sent its counter
+                self.counters[1].add(payload)
+                finished += 1
+                continue
+
+            if isinstance(payload, Exception):
+                raise payload
+
+            # the results come back in any order, they are written in the order of the batches
+            pending[sequence] = payload
+            while next_sequence in pending:
+                results = pending.pop(next_sequence)
+
+                begin = time.time()
+                self.sink(results)
+                counter.busy += time.time() - begin
+
+                counter.items += len(results)
+                counter.batches += 1
+                next_sequence += 1
+                self.in_flight.release()
+
+    def report(self):
+        """Return the summary lines of the stages of the last run"""
+        lines = ['pipeline: {0:.2f} s, {1} workers'.format(self.elapsed, self.workers)]
+        lines += [counter.report(self.elapsed) for counter in self.counters]
+        return lines
+
+
+def work_batches(work, tasks, results):
+    """Worker process loop: apply work to the batches until the end marker, then send the work counter"""
+    counter = StageCounter('work')
+
+    while True:
+        begin = time.time()
+        sequence, batch = tasks.get()
+        counter.waiting += time.time() - begin
+
+        if sequence is None:
+            break
+
+        begin = time.time()
+        try:
+            payload = work(batch)
+        except Exception as e:
+            results.put((sequence, picklable_error(e)))
+            return
+        counter.busy += time.time() - begin
+
+        counter.items += len(batch)
+        counter.batches += 1
+        results.put((sequence, payload))
+
+    results.put((None, counter))
+
+
+def picklable_error(error):
+    """Return the exception itself when it can be sent back through a queue, else a RuntimeError with its traceback"""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(traceback.format_exc())
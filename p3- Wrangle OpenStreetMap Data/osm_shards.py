@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script splits an OSM file into byte-range shards aligned on top level element boundaries.
+Each shard can be parsed on its own through ShardFile, which wraps the byte range in an <osm> root.
+"""
+
+import os
+import re
+
+import osm_input
+
+# a top level element starts with <node, <way or <relation ('<' can not appear inside attribute values)
+ELEMENT_START = re.compile(br'<(node|way|relation)[\s/>]')
+OSM_END = b'</osm>'
+
+# order of the top level elements in OSM files
+ELEMENT_ORDER = ['node', 'way', 'relation']
+
+# id attribute of an opening tag
+ELEMENT_ID = re.compile(br'\sid="(-?\d+)"')
+
+SHARD_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<osm>\n'
+SHARD_FOOTER = b'</osm>\n'
+
+READ_SIZE = 1 << 20
+
+# bytes read past a block so the opening tags starting in the block are complete
+TAG_MARGIN = 1 << 16
+
+
+def find_boundary(osm_file, offset, limit=None):
+    """Return the byte offset of the first top level element starting at or after offset, or None"""
+    osm_file.seek(offset)
+    position = offset
+    tail = b''
+
+    while limit is None or position < limit:
+        chunk = osm_file.read(READ_SIZE)
+        if not chunk:
+            return None
+
+        # keep a few bytes of the previous chunk so a tag split between two reads is still found
+        data = tail + chunk
+        match = ELEMENT_START.search(data)
+        if match:
+            boundary = position - len(tail) + match.start()
+            return boundary if limit is None or boundary < limit else None
+
+        tail = data[-16:]
+        position += len(chunk)
+
+    return None
+
+
+def element_type_at(osm_file, offset):
+    """Return the element type (node, way or relation) of the element starting at offset"""
+    osm_file.seek(offset)
+    return ELEMENT_START.match(osm_file.read(16)).group(1).decode('ascii')
+
+
+def find_section(osm_file, tag, start, end):
+    """Return the byte offset of the first top level element of type tag or of a later type, end if there is none.
+    The elements of OSM files come in node, way, relation order, so the section is found by binary search.
+    """
+    order = ELEMENT_ORDER.index(tag)
+    low, high = start, end
+
+    while low < high:
+        middle = (low + high) // 2
+        boundary = find_boundary(osm_file, middle, end)
+        if boundary is None:
+            high = middle
+        elif ELEMENT_ORDER.index(element_type_at(osm_file, boundary)) < order:
+            low = boundary + 1
+        else:
+            high = middle
+
+    boundary = find_boundary(osm_file, low, end)
+    return end if boundary is None else boundary
+
+
+def find_element(osm_file, tag, element_id, before):
+    """Return the byte offset of the top level element (tag, id) starting before the offset before, or None.
+    The file is scanned backward from before, so a close offset finds it in a single read.
+    """
+    tag = tag.encode('ascii')
+    element_id = str(element_id).encode('ascii')
+    end = before
+
+    while end > 0:
+        start = max(end - READ_SIZE, 0)
+        osm_file.seek(start)
+        data = osm_file.read(end - start + TAG_MARGIN)
+
+        for match in reversed(list(ELEMENT_START.finditer(data))):
+            if match.start() >= end - start or match.group(1) != tag:
+                continue
+
+            opening = data[match.start():data.find(b'>', match.start()) + 1]
+            id_match = ELEMENT_ID.search(opening)
+            if id_match and id_match.group(1) == element_id:
+                return start + match.start()
+
+        end = start
+
+    return None
+
+
+def find_osm_end(osm_file):
+    """Return the byte offset of the closing </osm> tag"""
+    size = os.fstat(osm_file.fileno()).st_size
+    window = READ_SIZE
+
+    while True:
+        start = max(size - window, 0)
+        osm_file.seek(start)
+        position = osm_file.read(size - start).rfind(OSM_END)
+        if position >= 0:
+            return start + position
+        if start == 0:
+            raise ValueError("no closing </osm> tag found")
+        window *= 2
+
+
+def split_shards(path, shard_count):
+    """Split the OSM file into at most shard_count (start, end) byte ranges of whole elements"""
+    if osm_input.compression(path):
+        raise ValueError("compressed OSM files can not be split into shards, decompress {0} "
+                         "or convert it with a single worker".format(path))
+
+    with open(path, 'rb') as osm_file:
+        first = find_boundary(osm_file, 0)
+        end = find_osm_end(osm_file)
+        if first is None or first >= end:
+            return []
+
+        shard_size = max((end - first) // shard_count, 1)
+        starts = [first]
+
+        for i in range(1, shard_count):
+            boundary = find_boundary(osm_file, max(first + i * shard_size, starts[-1] + 1), end)
+            if boundary is None:
+                break
+            starts.append(boundary)
+
+    return list(zip(starts, starts[1:] + [end]))
+
+
+class ShardFile(object):
+    """Read only file object returning the bytes of one shard wrapped in an <osm> root"""
+
+    def __init__(self, path, start, end):
+        self.osm_file = open(path, 'rb')
+        self.osm_file.seek(start)
+        self.remaining = end - start
+        self.pending = SHARD_HEADER
+        self.footer = SHARD_FOOTER
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.pending) + self.remaining + len(self.footer)
+
+        data = self.pending[:size]
+        self.pending = self.pending[size:]
+
+        if len(data) < size and self.remaining:
+            body = self.osm_file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(body)
+            data += body
+
+        if len(data) < size and not self.remaining:
+            missing = size - len(data)
+            data += self.footer[:missing]
+            self.footer = self.footer[missing:]
+
+        return data
+
+    def tell(self):
+        """Return the position reached in the OSM file (not in the wrapped shard)"""
+        return self.osm_file.tell()
+
+    def close(self):
+        self.osm_file.close()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script loads the OSM file straight into the database, without writing and re-reading the csv files.
+The shaped elements are inserted with batched executemany calls inside large transactions,
+the csv files can still be written on the side.
+"""
+
+import argparse
+import sqlite3
+
+import clean_cache
+import db_schema
+import osm_filters
+import osm_parsers
+import xml_to_csv
+
+DB_NAME = 'RiyadhMapDB.db'
+
+# table name and shaped element key of every table (the columns are defined in db_schema)
+TABLES = [('nodes', 'node'),
+          ('nodes_tags', 'node_tags'),
+          ('ways', 'way'),
+          ('ways_nodes', 'way_nodes'),
+          ('ways_tags', 'way_tags'),
+          ('relations', 'relation'),
+          ('relations_members', 'relation_members'),
+          ('relations_tags', 'relation_tags')]
+
+# bulk load settings: no rollback journal on disk, no fsync and a 256 MB page cache
+PRAGMAS = [('journal_mode', 'MEMORY'),
+           ('synchronous', 'OFF'),
+           ('cache_size', -262144),
+           ('temp_store', 'MEMORY')]
+
+BATCH_SIZE = 10000  # rows per executemany
+TRANSACTION_SIZE = 1000000  # rows per commit
+
+
+class DatabaseLoader(object):
+    """Insert rows in batches and commit them in large transactions"""
+
+    def __init__(self, conn, transaction_size=TRANSACTION_SIZE):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.transaction_size = transaction_size
+        self.pending = 0
+        self.rows = 0
+
+    def insert(self, sql, rows):
+        self.cur.executemany(sql, rows)
+        self.rows += len(rows)
+        self.pending += len(rows)
+
+        if self.pending >= self.transaction_size:
+            self.conn.commit()
+            self.pending = 0
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+
+class TableWriter(object):
+    """Writer with the UnicodeRowWriter interface buffering the rows of one table for the loader.
+    The rows are the field-ordered tuples of xml_to_csv, in the column order of the table.
+    """
+
+    def __init__(self, loader, table, batch_size=BATCH_SIZE):
+        self.loader = loader
+        self.batch_size = batch_size
+        self.sql = db_schema.insert_sql(table)
+        self.convert = db_schema.load_converter(table)
+        self.buffer = []
+
+    def writerow(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            # the rows are converted aside, a TeeWriter shares them with the csv writers
+            rows = [self.convert(row) for row in self.buffer] if self.convert else self.buffer
+            self.loader.insert(self.sql, rows)
+            self.buffer = []
+
+
+class TeeWriter(object):
+    """Writer sending every row to several writers, used to export the csv files while loading"""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def writerow(self, row):
+        for writer in self.writers:
+            writer.writerow(row)
+
+    def writerows(self, rows):
+        for writer in self.writers:
+            writer.writerows(rows)
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+
+def load_map(file_in, db_name=DB_NAME, validate=False, csv_export=False,
+             batch_size=BATCH_SIZE, transaction_size=TRANSACTION_SIZE, pragmas=PRAGMAS,
+             parser=osm_parsers.DEFAULT_PARSER, element_filter=None, normalized=False, cleaner=None):
+    """Stream the shaped elements of the OSM file into the database tables.
+    With csv_export the csv files of xml_to_csv are written in the same pass.
+    cleaner(key, value), if given, cleans the tag values (see clean_cache.CleaningCache).
+    element_filter, an osm_filters.ElementFilter, selects the loaded elements.
+    With normalized the tables are moved to the read only normalized layout of db_schema.normalize_tables.
+    Returns the number of inserted rows.
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    for name, value in pragmas:
+        cur.execute('PRAGMA {0} = {1};'.format(name, value))
+
+    db_schema.create_tables(cur)
+    conn.commit()
+
+    loader = DatabaseLoader(conn, transaction_size)
+    table_writers = dict((key, TableWriter(loader, table, batch_size)) for table, key in TABLES)
+
+    files, csv_writers = [], {}
+    writers = table_writers
+    if csv_export:
+        files, csv_writers = xml_to_csv.open_csv_writers([path for _, path, _ in xml_to_csv.CSV_OUTPUTS])
+        writers = dict((key, TeeWriter(writer, csv_writers[key])) for key, writer in table_writers.items())
+
+    try:
+        xml_to_csv.write_records(xml_to_csv.get_records(file_in, cleaner, parser, element_filter), writers, validate)
+
+        for writer in table_writers.values():
+            writer.flush()
+        loader.commit()
+
+        # indexes, tag statistics and spatial indexes are cheaper to build once the tables are full
+        db_schema.create_indexes(cur)
+        db_schema.build_tag_summary(cur)
+        db_schema.build_spatial_index(cur)
+        conn.commit()
+
+        if normalized:
+            db_schema.normalize_tables(cur)
+            conn.commit()
+            cur.execute('VACUUM;')
+    finally:
+        xml_to_csv.close_csv_writers(files, csv_writers)
+        conn.close()
+
+    return loader.rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('osm_file', nargs='?', default=xml_to_csv.OSM_PATH,
+                        help="OSM file to load, .bz2, .gz and .xz files are decompressed on the fly")
+    parser.add_argument('--db', default=DB_NAME, help="database file name")
+    parser.add_argument('--validate', action='store_true', help="validate the shaped elements against the schema")
+    parser.add_argument('--csv-export', action='store_true', help="also write the csv files")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="rows per executemany")
+    parser.add_argument('--transaction-size', type=int, default=TRANSACTION_SIZE, help="rows per transaction")
+    parser.add_argument('--normalized', action='store_true',
+                        help="store the user names, tag keys and common tag values once (read only database)")
+    parser.add_argument('--parser', choices=sorted(osm_parsers.PARSERS), default=osm_parsers.DEFAULT_PARSER,
+                        help="XML parser backend")
+    parser.add_argument('--clean', action='store_true', help="clean the street names and phone numbers")
+    parser.add_argument('--clean-cache-size', type=int, default=clean_cache.CACHE_SIZE,
+                        help="entries of the cleaning LRU cache")
+    parser.add_argument('--clean-cache', help="json file keeping the cleaning cache between runs")
+    osm_filters.add_arguments(parser)
+    args = parser.parse_args()
+
+    cleaner = None
+    if args.clean:
+        cleaner = clean_cache.CleaningCache(xml_to_csv.cleanTagValue, xml_to_csv.CLEANED_KEYS,
+                                            args.clean_cache_size, args.clean_cache)
+
+    rows = load_map(args.osm_file, args.db, validate=args.validate, csv_export=args.csv_export,
+                    batch_size=args.batch_size, transaction_size=args.transaction_size, parser=args.parser,
+                    element_filter=osm_filters.from_arguments(args), normalized=args.normalized, cleaner=cleaner)
+    print('{0} rows loaded into {1}'.format(rows, args.db))
+
+    if cleaner:
+        print(cleaner.stats())
+        if args.clean_cache:
+            cleaner.save()
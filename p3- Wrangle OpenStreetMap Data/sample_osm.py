@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script extracts samples like riyadh_sample.osm from a large OSM file.
+An element is sampled when it is the k-th element of its type (--every k),
+or when the seeded hash of its type and id falls under a fraction (--fraction f): the same seed samples
+the same elements in every extract.
+
+The nodes referenced by the sampled ways are kept too, so the sample has no dangling way node.
+The nodes come before the ways in OSM files, so the node ids of the sampled ways are collected first
+by a scan of the way section only (found by binary search in uncompressed files), then the sample is
+written in one pass. The elements are copied as raw bytes, without parsing their XML.
+The members of the sampled relations are not added to the sample.
+"""
+
+import argparse
+import hashlib
+import re
+
+import generate_osm
+import osm_input
+import osm_shards
+
+READ_SIZE = 1 << 20
+
+# node reference of a way
+ND_REF = re.compile(br'<nd\s+ref="(-?\d+)"')
+
+OSM_FOOTER = b'</osm>\n'
+
+
+def raw_elements(osm_file, start=0, end=None):
+    """Yield the (tag, bytes) of the top level elements of the file object from offset start to offset end.
+    The bytes of an element run up to the start of the next one, the bytes before the first element
+    (the XML declaration, the <osm> root and its <bounds>) are yielded with the tag None.
+    """
+    if start:
+        osm_file.seek(start)
+    remaining = None if end is None else end - start
+    data = b''
+    tag = None
+
+    while True:
+        size = READ_SIZE if remaining is None else min(READ_SIZE, remaining)
+        chunk = osm_file.read(size) if size else b''
+        if remaining is not None:
+            remaining -= len(chunk)
+
+        if not chunk:
+            # the last element ends at the closing </osm> tag
+            position = data.rfind(osm_shards.OSM_END)
+            if position >= 0:
+                data = data[:position]
+            if tag is not None or data:
+                yield tag, data
+            return
+
+        data += chunk
+        position = 0
+        # the element starting at 0 was matched by the previous search
+        for match in osm_shards.ELEMENT_START.finditer(data, 0 if tag is None else 1):
+            if tag is not None or match.start():
+                yield tag, data[position:match.start()]
+            tag = match.group(1).decode('ascii')
+            position = match.start()
+
+        data = data[position:]
+
+
+def element_id(data):
+    """Return the id attribute of the raw element"""
+    return osm_shards.ELEMENT_ID.search(data, 0, data.find(b'>') + 1).group(1)
+
+
+class Sampler(object):
+    """Decides which elements are sampled: every k-th element of each type, or a seeded hashed fraction"""
+
+    def __init__(self, every=None, fraction=None, seed=0):
+        if (every is None) == (fraction is None):
+            raise ValueError("sample with either every or fraction")
+        if every is not None and every < 1:
+            raise ValueError("every must be 1 or more")
+
+        self.every = every
+        self.threshold = None if fraction is None else int(fraction * 2 ** 64)
+        self.seed = str(seed).encode('ascii') + b'/'
+        self.counts = dict((tag, 0) for tag in osm_shards.ELEMENT_ORDER)
+
+    def sampled(self, tag, data):
+        if self.every is not None:
+            index = self.counts[tag]
+            self.counts[tag] = index + 1
+            return index % self.every == 0
+
+        key = self.seed + tag.encode('ascii') + b'/' + element_id(data)
+        return int(hashlib.md5(key).hexdigest()[:16], 16) < self.threshold
+
+
+def way_section_nodes(path, sampler):
+    """Return the set of the node ids referenced by the sampled ways of the OSM file"""
+    nodes = set()
+
+    with osm_input.osm_input(path) as osm_file:
+        if osm_input.compression(path):
+            # a compressed file can not be searched, the node section is read and skipped
+            elements = raw_elements(osm_file)
+        else:
+            start = osm_shards.find_boundary(osm_file, 0) or 0
+            end = osm_shards.find_osm_end(osm_file)
+            ways = osm_shards.find_section(osm_file, 'way', start, end)
+            relations = osm_shards.find_section(osm_file, 'relation', ways, end)
+            elements = raw_elements(osm_file, ways, relations)
+
+        for tag, data in elements:
+            if tag == 'way' and sampler.sampled(tag, data):
+                nodes.update(int(ref) for ref in ND_REF.findall(data))
+            elif tag == 'relation':
+                break
+
+    return nodes
+
+
+def sample_osm(in_path, out_path, every=None, fraction=None, seed=0, closure=True):
+    """Write the sample of the OSM file in_path to out_path and return the number of elements written by tag"""
+    new_sampler = lambda: Sampler(every, fraction, seed)
+    closure_nodes = way_section_nodes(in_path, new_sampler()) if closure else set()
+    sampler = new_sampler()
+    counts = dict((tag, 0) for tag in osm_shards.ELEMENT_ORDER)
+
+    out = generate_osm.open_output(out_path)
+    try:
+        with osm_input.osm_input(in_path) as osm_file:
+            for tag, data in raw_elements(osm_file):
+                if tag is None:
+                    out.write(data)
+                    continue
+
+                # the sampler is asked first, so it counts every element
+                if sampler.sampled(tag, data) or (tag == 'node' and int(element_id(data)) in closure_nodes):
+                    out.write(data)
+                    counts[tag] += 1
+
+        out.write(OSM_FOOTER)
+    finally:
+        out.close()
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('in_path', help="OSM file to sample (.bz2, .gz and .xz are decompressed on the fly)")
+    parser.add_argument('out_path', help="sample to write (.bz2, .gz and .xz are compressed)")
+    method = parser.add_mutually_exclusive_group(required=True)
+    method.add_argument('--every', type=int, metavar='K', help="sample every k-th element of each type")
+    method.add_argument('--fraction', type=float, help="sample this fraction of the elements, by hashed id")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the hashed fraction")
+    parser.add_argument('--no-closure', dest='closure', action='store_false',
+                        help="do not add the nodes of the sampled ways")
+    args = parser.parse_args()
+
+    counts = sample_osm(args.in_path, args.out_path, args.every, args.fraction, args.seed, args.closure)
+    print('{0}: {1[node]} nodes, {1[way]} ways, {1[relation]} relations'.format(args.out_path, counts))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script compiles a cerberus schema (like schema.py) into a specialized validator.
+The schema is turned once into flat python code doing the per-field type/coerce checks,
+so validating an element costs a few isinstance() calls instead of a cerberus run.
+The batches of records are validated row by row with the functions of row_check, which only answer
+valid or not valid, cerberus is still used to report the errors.
+"""
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+try:
+    STR_TYPES = basestring
+    INT_TYPES = (int, long)
+except NameError:
+    STR_TYPES = str
+    INT_TYPES = (int,)
+
+# python expression checking the type of the value {0}, same semantics as the cerberus type rules
+TYPE_CHECKS = {
+    'boolean': 'isinstance({0}, bool)',
+    'dict': 'isinstance({0}, Mapping)',
+    'float': 'isinstance({0}, FLOAT_TYPES)',
+    'integer': 'isinstance({0}, INT_TYPES)',
+    'list': '(isinstance({0}, Sequence) and not isinstance({0}, STR_TYPES))',
+    'number': '(isinstance({0}, FLOAT_TYPES) and not isinstance({0}, bool))',
+    'string': 'isinstance({0}, STR_TYPES)'
+}
+
+SUPPORTED_RULES = set(['type', 'coerce', 'required', 'schema'])
+
+
+class CompiledValidator(object):
+    """Validator generated from a cerberus schema, unknown fields are not allowed like in cerberus"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.namespace = {'Mapping': Mapping, 'Sequence': Sequence, 'STR_TYPES': STR_TYPES,
+                          'INT_TYPES': INT_TYPES, 'FLOAT_TYPES': INT_TYPES + (float,)}
+        self.source = []
+
+    def row_check(self, key, fields):
+        """Return a function checking a tuple of the fields values (in this order) of the schema key.
+        The key is a dict or a list of dicts, a row is valid when the matching dict would be.
+        This is the batch entry point: xml_to_csv.validate_records runs these checks on every row of a batch.
+        """
+        rules = self.schema[key]
+        if rules['type'] == 'list':
+            rules = rules['schema']
+        return self.namespace[self._compile_row(rules['schema'], fields)]
+
+    def _constant(self, value):
+        name = 'C{0}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def _compile_mapping(self, fields):
+        """Generate the function checking a mapping against its fields rules and return its name"""
+        checks = []
+        required = set()
+
+        for field, rules in sorted(fields.items()):
+            if rules.get('required'):
+                required.add(field)
+
+            check = self._field_check('d[{0!r}]'.format(field), field, rules)
+
+            if field not in required:
+                check = '({0!r} not in d or ({1}))'.format(field, check)
+            checks.append(check)
+
+        name = 'check_{0}'.format(len(self.source))
+        known = self._constant(frozenset(fields))
+        required = self._constant(frozenset(required))
+
+        source = ['def {0}(d):'.format(name),
+                  '    if not isinstance(d, Mapping) or not {0}.issuperset(d) or not {1}.issubset(d):'.format(
+                      known, required),
+                  '        return False',
+                  '    try:',
+                  '        return bool({0})'.format(' and\n                    '.join(checks or ['True'])),
+                  '    except Exception:',
+                  '        return False']
+        self.source.append('\n'.join(source))
+
+        exec('\n'.join(source), self.namespace)
+        return name
+
+    def _compile_row(self, fields, order):
+        """Generate the function checking a tuple of the fields values in order and return its name"""
+        checks = [self._field_check('r[{0}]'.format(i), field, fields[field]) for i, field in enumerate(order)]
+
+        name = 'check_{0}'.format(len(self.source))
+        source = ['def {0}(r):'.format(name),
+                  '    if len(r) != {0}:'.format(len(order)),
+                  '        return False',
+                  '    try:',
+                  '        return bool({0})'.format(' and\n                    '.join(checks or ['True'])),
+                  '    except Exception:',
+                  '        return False']
+        self.source.append('\n'.join(source))
+
+        exec('\n'.join(source), self.namespace)
+        return name
+
+    def _field_check(self, value, field, rules):
+        """Return the python expression checking the value expression against the field rules"""
+        unsupported = set(rules) - SUPPORTED_RULES
+        if unsupported:
+            raise ValueError("rules {0} of field '{1}' can not be compiled".format(sorted(unsupported), field))
+
+        coerce = rules.get('coerce')
+        if coerce is not None:
+            for processor in (coerce if isinstance(coerce, Sequence) else [coerce]):
+                value = '{0}({1})'.format(self._constant(processor), value)
+
+        check = TYPE_CHECKS[rules['type']].format(value) if 'type' in rules else 'True'
+
+        if 'schema' in rules:
+            if rules.get('type') == 'list':
+                item_check = self._compile_mapping(rules['schema']['schema'])
+                check += ' and all(map({0}, {1}))'.format(item_check, value)
+            else:
+                check += ' and {0}({1})'.format(self._compile_mapping(rules['schema']), value)
+
+        return check
+
+
+def compile_schema(schema):
+    """Compile the cerberus schema into a CompiledValidator"""
+    return CompiledValidator(schema)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script holds fixed memory sketches summarizing streams of values, for the approximate audits of audit.py:
+
+    HyperLogLog:  estimated number of distinct values, 2 ** precision one byte registers
+    SpaceSaving:  most frequent values with their count upper bound, capacity counters
+    ValueSketch:  both of them and the exact number of values
+"""
+
+import hashlib
+import math
+import struct
+
+# default standard error of the distinct counts: 1.04 / sqrt(2 ** 10), about 3%
+PRECISION = 10
+
+# counters of the frequent values
+CAPACITY = 50
+
+
+def hash64(value):
+    """Return a 64 bit hash of the value, the same in every run and python version"""
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    """Distinct count estimator (Flajolet et al. 2007) with the linear counting correction of small counts"""
+
+    def __init__(self, precision=PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self.rank_bits = 64 - precision
+        self.rank_mask = (1 << self.rank_bits) - 1
+
+    def add(self, value):
+        hashed = hash64(value)
+        index = hashed >> self.rank_bits
+        # position of the first 1 bit of the remaining bits
+        rank = self.rank_bits - (hashed & self.rank_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Add the values of another HyperLogLog of the same precision"""
+        if other.precision != self.precision:
+            raise ValueError("can not merge HyperLogLogs of different precisions")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        """Return the estimated number of distinct values added"""
+        size = self.size
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+
+        zeros = self.registers.count(b'\0')
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving(object):
+    """Frequent values estimator (Metwally et al. 2005): a value seen more than n / capacity times
+    out of n is always kept, with a count over estimated by at most its error.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, value):
+        counts = self.counts
+        if value in counts:
+            counts[value] += 1
+        elif len(counts) < self.capacity:
+            counts[value] = 1
+            self.errors[value] = 0
+        else:
+            # the least counted value is replaced, its count becomes the error of the new one
+            smallest = min(counts, key=counts.get)
+            minimum = counts.pop(smallest)
+            del self.errors[smallest]
+            counts[value] = minimum + 1
+            self.errors[value] = minimum
+
+    def top(self, n=None):
+        """Return the (value, count, error) of the n most frequent values, the most frequent first"""
+        values = sorted(self.counts, key=lambda value: (-self.counts[value], value))[:n]
+        return [(value, self.counts[value], self.errors[value]) for value in values]
+
+
+class ValueSketch(object):
+    """Summary of the values of a key: exact size (len), estimated distinct count and frequent values"""
+
+    def __init__(self, precision=PRECISION, capacity=CAPACITY):
+        self.size = 0
+        self.distinct_values = HyperLogLog(precision)
+        self.frequent_values = SpaceSaving(capacity)
+
+    def add(self, value):
+        self.size += 1
+        self.distinct_values.add(value)
+        self.frequent_values.add(value)
+
+    def __len__(self):
+        return self.size
+
+    def distinct(self):
+        # the estimate can not exceed the number of values
+        return min(self.distinct_values.count(), self.size)
+
+    def top(self, n=None):
+        return self.frequent_values.top(n)
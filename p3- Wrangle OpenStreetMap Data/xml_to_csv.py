@@ -1,323 +1,780 @@
-# !/usr/bin/env python
-# -*- coding: utf-8 -*-
-
-"""This script is used both for data cleaning then form conversion"""
-
-
-import csv
-import codecs
-import pprint
-import re
-import xml.etree.cElementTree as ET
-import io
-
-import cerberus
-
-import schema
-
-OSM_PATH = "riyadh_saudi-arabia.osm"
-#OSM_PATH = "riyadh_sample.osm"
-
-NODES_PATH = "nodes.csv"
-NODE_TAGS_PATH = "nodes_tags.csv"
-WAYS_PATH = "ways.csv"
-WAY_NODES_PATH = "ways_nodes.csv"
-WAY_TAGS_PATH = "ways_tags.csv"
-
-LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
-PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
-
-SCHEMA = schema.schema
-
-# Make sure the fields order in the csvs matches the column order in the sql table schema
-NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
-NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
-WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_NODES_FIELDS = ['id', 'node_id', 'position']
-
-
-def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
-
-    node_attribs = {}
-
-    way_attribs = {}
-
-    way_nodes = []
-
-    tags = []  # Handle secondary tags the same way for both node and way elements
-
-    tagType = []
-
-    tagKey = []
-
-    if element.tag == 'node':
-
-        node_attribs['id'] = element.attrib['id']
-
-        node_attribs['user'] = element.attrib['user']
-
-        node_attribs['uid'] = element.attrib['uid']
-
-        node_attribs['version'] = element.attrib['version']
-
-        node_attribs['lat'] = element.attrib['lat']
-
-        node_attribs['lon'] = element.attrib['lon']
-
-        node_attribs['timestamp'] = element.attrib['timestamp']
-
-        node_attribs['changeset'] = element.attrib['changeset']
-
-        for tag in element.iter("tag"):
-
-            if not PROBLEMCHARS.search(tag.attrib['k']):  # if it has prob chars then ignore
-
-
-                if LOWER_COLON.search(tag.attrib['k']):
-
-                    tagKey = tag.attrib['k'].split(':', 1)[1]  # only split once
-
-                    tagType = tag.attrib['k'].split(':')[0]
-
-
-
-                else:
-
-                    tagKey = tag.attrib['k']
-
-                    tagType = 'regular'
-
-                tags.append({'id': node_attribs['id'], 'key': tagKey, 'value': tag.attrib['v'], 'type': tagType})
-
-        return {'node': node_attribs, 'node_tags': tags}
-
-
-    elif element.tag == 'way':
-
-        way_attribs['id'] = element.attrib['id']
-
-        way_attribs['user'] = element.attrib['user']
-
-        way_attribs['uid'] = element.attrib['uid']
-
-        way_attribs['version'] = element.attrib['version']
-
-        way_attribs['timestamp'] = element.attrib['timestamp']
-
-        way_attribs['changeset'] = element.attrib['changeset']
-
-        # tags = []
-
-        for tag in element.iter('tag'):
-
-            if not PROBLEMCHARS.search(tag.attrib['k']):
-
-                tag_colon = LOWER_COLON.search(tag.attrib['k'])
-
-                if tag_colon:
-
-                    tagKey = tag.attrib['k'].split(':', 1)[1]
-
-                    tagType = tag.attrib['k'].split(':')[0]
-
-
-
-                else:
-
-                    tagKey = tag.attrib['k']
-
-                    tagType = 'regular'
-
-                tags.append({'id': way_attribs['id'], 'key': tagKey, 'value': tag.attrib['v'], 'type': tagType})
-
-    pos = 0
-
-    for nd in element.iter('nd'):
-        way_nodes.append({'id': way_attribs['id'], 'node_id': nd.attrib['ref'], 'position': pos})
-
-        pos += 1
-
-    return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
-
-
-# ================================================== #
-#               Helper Functions                     #
-# ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
-
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
-
-
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema"""
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_string = pprint.pformat(errors)
-
-        raise Exception(message_string.format(field, error_string))
-
-
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
-
-    def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-                                                    k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in
-                                                    row.iteritems()
-                                                    })
-
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
-
-
-# ================================================== #
-#               Main Function                        #
-# ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-            codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-            codecs.open(WAYS_PATH, 'w') as ways_file, \
-            codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-            codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
-
-
-# ================================================== #
-#               Cleaning Function                    #
-# ================================================== #
-def clean(tag):
-
-    tagValue=tag.attrib['v']
-    if tag.attrib['k']=='addr:street':
-        tagValue=cleanStreetName(tagValue)
-    elif tag.attrib['k']=='phone':
-        tagValue=cleanPhoneNumber(tagValue)
-    return tagValue
-
-
-
-
-    # fixing the case for english names
-def cleanStreetName(streetName):
-    """This function takes a string of street name and clean it in terms of case used and street type"""
-
-    arabicText = re.compile(r'^[\u0600-\u06ff\s\u0031-\u0039]+$')
-
-
-    mapping = {"St": "Street",
-                "St.": "Street",
-                "Rd": "Road",
-                "Rd.": "Road"}
-
-    # only clean english text
-    if not arabicText.search(streetName):
-        # removing starting and ending whitespace
-        streetName = streetName.strip().split()
-
-        for word in streetName:
-
-            # check if the word is not an abbreviation to fix its case
-            if not word.isupper():
-                streetName[streetName.index(word)] = word.title()
-
-        # return the last item in the list which possibly represent the type
-        streetType = streetName[-1]
-
-        if streetType in mapping:
-            # replace the old type with the new one
-            streetName[-1] = mapping[streetType]
-
-        streetName = ' '.join(streetName)
-
-    return streetName
-
-def cleanPhoneNumber(phone):
-    """This function take a string phone number and reformat it."""
-
-    # mapping of erroneous street types
-    mapping = {"90000002": "+966920000002", "92000702": "+966920000702"}
-
-    #standard numbers formats in Saudi Arabia
-    homeNum_re = re.compile(r'^(00966|\+966|966)?0?1?1?([\d]{7})$', re.IGNORECASE)
-    mobileNum_re = re.compile(r'^(00966|\+966|966)?0?(5[\d]{8})$', re.IGNORECASE)
-    uniNum_re = re.compile(r'^(00966|\+966|966)?(9200[\d]{5})$', re.IGNORECASE)
-    tollFreeNum_re = re.compile(r'^(00966|\+966|966)?(800[\d]{7})$', re.IGNORECASE)
-
-
-    if ";" in phone:
-        phone = phone.split(';')[0]
-
-    if tollFreeNum_re.match(phone):
-
-        # toll free numbers
-        phone = tollFreeNum_re.sub(r'+966\2', phone)
-
-    elif uniNum_re.match(phone):
-
-        # universal access numbers
-        phone = uniNum_re.sub(r'+966\2', phone)
-
-
-    elif mobileNum_re.match(phone):
-
-        # mobile numbers
-        phone = mobileNum_re.sub(r'+966\2', phone)
-
-
-    elif homeNum_re.match(phone):
-
-        # home numbers
-        phone = homeNum_re.sub(r'+96611\2', phone)
-
-    else:
-        # invalid numbers
-        phone = mapping[phone]
-
-    return phone
-
-
-if __name__ == '__main__':
-    process_map(OSM_PATH, validate=True)
-
-
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""This script is used both for data cleaning then form conversion"""
+
+
+import argparse
+import csv
+import codecs
+import json
+import multiprocessing
+import os
+import pprint
+import re
+import shutil
+import tempfile
+import time
+import io
+
+import cerberus
+
+import clean_cache
+import node_store
+import osm_filters
+import osm_input
+import osm_instrument
+import osm_parsers
+import osm_pipeline
+import osm_shards
+import schema
+import schema_validator
+
+OSM_PATH = "riyadh_saudi-arabia.osm"
+#OSM_PATH = "riyadh_sample.osm"
+
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+SCHEMA = schema.schema
+COMPILED_SCHEMA = schema_validator.compile_schema(SCHEMA)
+
+# Make sure the fields order in the csvs matches the column order in the sql table schema
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_type', 'member_id', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+# shaped element key, csv path and fields of every csv output, in the order they are opened
+CSV_OUTPUTS = [('node', NODES_PATH, NODE_FIELDS),
+               ('node_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+               ('way', WAYS_PATH, WAY_FIELDS),
+               ('way_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS),
+               ('way_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+               ('relation', RELATIONS_PATH, RELATION_FIELDS),
+               ('relation_members', RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+               ('relation_tags', RELATION_TAGS_PATH, RELATION_TAGS_FIELDS)]
+
+# fields of every shaped element key
+OUTPUT_FIELDS = dict((key, fields) for key, _, fields in CSV_OUTPUTS)
+
+# element tag: fields of its main row, then the shaped element key of its main row, tag rows and child rows
+RECORD_LAYOUTS = {'node': (NODE_FIELDS, 'node', 'node_tags', None),
+                  'way': (WAY_FIELDS, 'way', 'way_tags', 'way_nodes'),
+                  'relation': (RELATION_FIELDS, 'relation', 'relation_tags', 'relation_members')}
+
+# compiled check of the rows of every shaped element key
+ROW_CHECKS = dict((key, COMPILED_SCHEMA.row_check(key, fields)) for key, _, fields in CSV_OUTPUTS)
+
+# shaped elements validated together by the compiled schema
+VALIDATION_BATCH_SIZE = 1000
+
+# rows buffered by a UnicodeRowWriter before being written at once
+WRITE_BATCH_SIZE = 5000
+
+# checkpoint file of the resumable runs and elements converted between two checkpoints
+CHECKPOINT_PATH = 'xml_to_csv.checkpoint'
+CHECKPOINT_INTERVAL = 100000
+
+# shards per worker in the parallel mode, more shards than workers keeps all the workers busy
+SHARDS_PER_WORKER = 4
+
+
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', cleaner=None):
+    """Clean and shape node, way or relation XML element to Python dict.
+    This is the dict view of shape_record, kept for compatibility.
+    cleaner(key, value), if given, cleans the tag values (see clean_cache.CleaningCache).
+    """
+    record = shape_record(element, cleaner)
+    if record:
+        return record_to_dict(record)
+
+
+# ================================================== #
+#               Compact Records                      #
+# ================================================== #
+def shape_record(element, cleaner=None):
+    """Shape node, way or relation XML element to a compact record of field-ordered tuples:
+    (element tag, main row, tag rows, child rows). Returns None for any other element.
+    """
+    if element.tag not in RECORD_LAYOUTS:
+        return None
+
+    return shape_parts(*osm_parsers.element_parts(element), cleaner=cleaner)
+
+
+def shape_parts(tag, attrib, tags, refs, cleaner=None):
+    """Shape the parts of an element, its attributes, (k, v) tag pairs and nd refs or members, to a compact record"""
+    row = tuple([attrib[field] for field in RECORD_LAYOUTS[tag][0]])
+    element_id = row[0]
+
+    tag_rows = []
+    for k, v in tags:
+
+        if PROBLEMCHARS.search(k):  # if it has prob chars then ignore
+            continue
+
+        if LOWER_COLON.search(k):
+            tagType, tagKey = k.split(':', 1)  # only split once
+        else:
+            tagKey, tagType = k, 'regular'
+
+        if cleaner:
+            v = cleaner(k, v)
+
+        tag_rows.append((element_id, tagKey, v, tagType))
+
+    if tag == 'relation':
+        child_rows = [(element_id, member_type, ref, role, position)
+                      for position, (member_type, ref, role) in enumerate(refs)]
+    else:
+        child_rows = [(element_id, ref, position) for position, ref in enumerate(refs)]
+
+    return (tag, row, tag_rows, child_rows)
+
+
+def get_records(osm_file, cleaner=None, parser=osm_parsers.DEFAULT_PARSER, element_filter=None):
+    """Yield the compact record of every node, way and relation of the OSM file, read with the parser backend.
+    element_filter, an osm_filters.ElementFilter, selects the elements while they are parsed.
+    """
+    for tag, attrib, tags, refs in osm_parsers.iter_parts(osm_file, osm_parsers.ELEMENT_TAGS, parser, element_filter):
+        yield shape_parts(tag, attrib, tags, refs, cleaner)
+
+
+def record_to_dict(record):
+    """Convert a compact record to the shaped element dict returned by shape_element"""
+    tag, row, tag_rows, child_rows = record
+    fields, main, tags_key, child_key = RECORD_LAYOUTS[tag]
+
+    el = {main: dict(zip(fields, row)),
+          tags_key: [dict(zip(OUTPUT_FIELDS[tags_key], tag_row)) for tag_row in tag_rows]}
+    if child_key:
+        el[child_key] = [dict(zip(OUTPUT_FIELDS[child_key], child_row)) for child_row in child_rows]
+
+    return el
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema"""
+    if validator.validate(element, schema) is not True:
+        field, errors = next(validator.errors.iteritems())
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+
+        raise Exception(message_string.format(field, error_string))
+
+
+def validate_records(records, validator):
+    """Validate a batch of compact records with the compiled row checks.
+    Invalid records go through validate_element as dicts so cerberus raises its usual error message.
+    """
+    for record in records:
+        tag, row, tag_rows, child_rows = record
+        _, main, tags_key, child_key = RECORD_LAYOUTS[tag]
+
+        if not (ROW_CHECKS[main](row) and all(map(ROW_CHECKS[tags_key], tag_rows)) and
+                (child_key is None or all(map(ROW_CHECKS[child_key], child_rows)))):
+            validate_element(record_to_dict(record), validator)
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    """Extend csv.DictWriter to handle Unicode input"""
+
+    def writerow(self, row):
+        super(UnicodeDictWriter, self).writerow({
+                                                    k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in
+                                                    row.iteritems()
+                                                    })
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+class UnicodeRowWriter(object):
+    """csv.writer for field-ordered tuples, the rows are buffered and written in batches with unicode encoded"""
+
+    def __init__(self, csv_file, fields, batch_size=WRITE_BATCH_SIZE):
+        self.writer = csv.writer(csv_file)
+        self.fields = fields
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def writeheader(self):
+        self.writer.writerow(self.fields)
+
+    def writerow(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows([[v.encode('utf-8') if isinstance(v, unicode) else v for v in row]
+                               for row in self.buffer])
+        self.buffer = []
+
+
+def open_csv_writers(paths, header=True):
+    """Open a UnicodeRowWriter for every csv output and return the open files and the writers by key"""
+    files = []
+    writers = {}
+
+    for (key, _, fields), path in zip(CSV_OUTPUTS, paths):
+        csv_file = codecs.open(path, 'w')
+        files.append(csv_file)
+
+        writers[key] = UnicodeRowWriter(csv_file, fields)
+        if header:
+            writers[key].writeheader()
+
+    return files, writers
+
+
+def reopen_csv_writers(paths, sizes):
+    """Truncate the csv outputs to the sizes saved by a checkpoint and reopen them to append rows, without header"""
+    files = []
+    writers = {}
+
+    for (key, _, fields), path, size in zip(CSV_OUTPUTS, paths, sizes):
+        csv_file = codecs.open(path, 'r+b')
+        files.append(csv_file)
+
+        csv_file.truncate(size)
+        csv_file.seek(size)
+        writers[key] = UnicodeRowWriter(csv_file, fields)
+
+    return files, writers
+
+
+def close_csv_writers(files, writers):
+    """Write the rows still buffered by the writers then close the csv files"""
+    try:
+        for writer in writers.values():
+            writer.flush()
+    finally:
+        for csv_file in files:
+            csv_file.close()
+
+
+def write_records(records, writers, validate, after_batch=None):
+    """Optionally validate then write the compact records to their writers, by batches.
+    after_batch(batch), if given, is called once every full batch is written.
+    """
+    validator = cerberus.Validator()
+    batch = []
+
+    for record in records:
+        batch.append(record)
+
+        if len(batch) == VALIDATION_BATCH_SIZE:
+            write_batch(batch, writers, validate, validator)
+            if after_batch:
+                after_batch(batch)
+            batch = []
+
+    write_batch(batch, writers, validate, validator)
+
+
+def write_batch(batch, writers, validate, validator):
+    """Validate a batch of compact records at once then write their rows in order"""
+    if validate is True:
+        validate_records(batch, validator)
+
+    for tag, row, tag_rows, child_rows in batch:
+        _, main, tags_key, child_key = RECORD_LAYOUTS[tag]
+
+        writers[main].writerow(row)
+        if child_key:
+            writers[child_key].writerows(child_rows)
+        writers[tags_key].writerows(tag_rows)
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, workers=1, cleaner=None, parser=osm_parsers.DEFAULT_PARSER, pipeline=False,
+                stats=None, checkpoint=None, resume=False, checkpoint_interval=CHECKPOINT_INTERVAL,
+                element_filter=None, node_store_dir=None):
+    """Iteratively process each XML element and write to csv(s).
+    cleaner(key, value), if given, cleans the tag values.
+    parser is the name of the osm_parsers backend reading the file.
+    With pipeline the elements are shaped by workers processes fed by a parser thread (see process_map_pipelined),
+    otherwise several workers convert shards of the map.
+    stats, an osm_instrument.StageStats, times the stages of a serial run.
+    checkpoint is the checkpoint file of a resumable serial run, saved every checkpoint_interval elements
+    (see process_map_checkpointed).
+    element_filter, an osm_filters.ElementFilter, selects the converted elements.
+    node_store_dir is filled with the node store of the converted nodes (see node_store.py).
+    """
+
+    sharded = not pipeline and (workers is None or workers > 1)
+
+    if checkpoint and (pipeline or sharded):
+        raise ValueError("checkpoints are only saved by serial runs")
+
+    # the stages of the worker processes are timed in their own copy of the stats, never merged back
+    if stats is not None and (pipeline or sharded):
+        raise ValueError("the stage stats only time serial runs")
+
+    # the kept nodes are only known by a filter reading the whole map
+    if element_filter and element_filter.way_nodes and (resume or sharded):
+        raise ValueError("the way nodes filter needs to read the whole map, it can not be sharded or resumed")
+
+    if node_store_dir:
+        node_store.require_numpy()
+
+    result = None
+    if pipeline:
+        result = process_map_pipelined(file_in, validate, workers, cleaner, parser, element_filter)
+    elif sharded:
+        process_map_sharded(file_in, validate, workers, cleaner, parser, element_filter)
+    elif checkpoint:
+        process_map_checkpointed(file_in, validate, cleaner, parser, stats, checkpoint, resume,
+                                 checkpoint_interval, element_filter)
+    else:
+        files, writers = open_csv_writers([path for _, path, _ in CSV_OUTPUTS])
+        try:
+            write_map(file_in, writers, validate, cleaner, parser, stats, element_filter=element_filter)
+        finally:
+            begin = time.time()
+            close_csv_writers(files, writers)
+            if stats is not None:
+                stats.add('write', None, time.time() - begin)
+
+    # built from nodes.csv once it is complete, the same way whatever the mode and after a resumed run
+    if node_store_dir:
+        begin = time.time()
+        node_store.build_node_store(node_store_dir, NODES_PATH)
+        if stats is not None:
+            stats.add('write', 'node_store', time.time() - begin)
+
+    return result
+
+
+def write_map(osm_file, writers, validate, cleaner, parser, stats=None, after_batch=None, element_filter=None):
+    """Convert the elements of the OSM file (a path or a file object) to the writers, timed when stats is given"""
+    if stats is None:
+        write_records(get_records(osm_file, cleaner, parser, element_filter), writers, validate, after_batch)
+    else:
+        write_records_timed(osm_file, writers, validate, cleaner, parser, stats, after_batch, element_filter)
+
+
+def write_records_timed(file_in, writers, validate, cleaner, parser, stats, after_batch=None, element_filter=None):
+    """Same conversion as write_records(get_records(...)) with every stage timed by element type in stats"""
+    clock = stats.clock
+    cleaner = stats.timed_cleaner(cleaner, CLEANED_KEYS) if cleaner else None
+    validator = cerberus.Validator()
+    elements = iter(osm_parsers.iter_parts(file_in, osm_parsers.ELEMENT_TAGS, parser, element_filter))
+    batch = []
+
+    while True:
+        begin = clock()
+        parts = next(elements, None)
+        if parts is None:
+            break
+        tag = parts[0]
+        shaping = clock()
+        stats.add('parse', tag, shaping - begin)
+
+        batch.append(shape_parts(*parts, cleaner=cleaner))
+        stats.add('shape', tag, clock() - shaping)
+        stats.element(tag)
+
+        if len(batch) == VALIDATION_BATCH_SIZE:
+            write_batch_timed(batch, writers, validate, validator, stats)
+            if after_batch:
+                after_batch(batch)
+            batch = []
+
+    write_batch_timed(batch, writers, validate, validator, stats)
+
+
+def write_batch_timed(batch, writers, validate, validator, stats):
+    """write_batch with the validation and the writing of every record timed by element type"""
+    clock = stats.clock
+
+    for record in batch:
+        tag, row, tag_rows, child_rows = record
+        _, main, tags_key, child_key = RECORD_LAYOUTS[tag]
+
+        if validate is True:
+            begin = clock()
+            validate_records([record], validator)
+            stats.add('validate', tag, clock() - begin)
+
+        begin = clock()
+        write_batch([record], writers, False, validator)
+        stats.add('write', tag, clock() - begin)
+
+        stats.rows[main] += 1
+        stats.rows[tags_key] += len(tag_rows)
+        if child_key:
+            stats.rows[child_key] += len(child_rows)
+
+
+def process_shard(args):
+    """Convert the elements of one byte-range shard into headerless csv parts"""
+    file_in, start, end, part_paths, validate, cleaner, parser, element_filter = args
+
+    shard = osm_shards.ShardFile(file_in, start, end)
+    files, writers = open_csv_writers(part_paths, header=False)
+    try:
+        write_records(get_records(shard, cleaner, parser, element_filter), writers, validate)
+    finally:
+        shard.close()
+        close_csv_writers(files, writers)
+
+
+def process_map_sharded(file_in, validate, workers=None, cleaner=None, parser=osm_parsers.DEFAULT_PARSER,
+                        element_filter=None):
+    """Process the map in parallel, one byte-range shard per task, then stitch the csv parts in shard order.
+    The stitched csvs are byte-identical to the ones written by a serial run.
+    Every task works on its own copy of the cleaner.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    shards = osm_shards.split_shards(file_in, workers * SHARDS_PER_WORKER)
+
+    parts_dir = tempfile.mkdtemp(prefix='osm_parts_', dir=os.path.dirname(os.path.abspath(NODES_PATH)))
+    try:
+        tasks = []
+        for index, (start, end) in enumerate(shards):
+            part_paths = [os.path.join(parts_dir, '{0}.{1:05d}'.format(os.path.basename(path), index))
+                          for _, path, _ in CSV_OUTPUTS]
+            tasks.append((file_in, start, end, part_paths, validate, cleaner, parser, element_filter))
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            pool.map(process_shard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        # every output gets its header followed by its parts in shard order
+        files, writers = open_csv_writers([path for _, path, _ in CSV_OUTPUTS])
+        try:
+            for i, csv_file in enumerate(files):
+                for task in tasks:
+                    with open(task[3][i], 'rb') as part:
+                        shutil.copyfileobj(part, csv_file)
+        finally:
+            close_csv_writers(files, writers)
+    finally:
+        shutil.rmtree(parts_dir)
+
+
+# ================================================== #
+#               Checkpoints                          #
+# ================================================== #
+class Checkpointer(object):
+    """after_batch callback of write_records saving a checkpoint every interval elements.
+    A checkpoint holds the position reached in the OSM file (a hint, past the last written element),
+    the (tag, id) of the last written element and the sizes of the flushed csv files.
+    """
+
+    def __init__(self, path, file_in, stream, files, writers, interval=CHECKPOINT_INTERVAL, elements=0):
+        self.path = path
+        self.file_in = file_in
+        self.stream = stream
+        self.files = files
+        self.writers = writers
+        self.interval = interval
+        self.elements = elements
+        self.next_checkpoint = elements + interval
+
+    def __call__(self, batch):
+        self.elements += len(batch)
+        if self.elements >= self.next_checkpoint:
+            self.next_checkpoint = self.elements + self.interval
+            self.save(batch[-1])
+
+    def save(self, last_record):
+        for writer in self.writers.values():
+            writer.flush()
+        for csv_file in self.files:
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
+
+        tag, row = last_record[:2]
+        state = {'osm_file': os.path.abspath(self.file_in),
+                 'osm_size': os.path.getsize(self.file_in),
+                 'offset': self.stream.tell(),
+                 'last': [tag, row[0]],
+                 'elements': self.elements,
+                 'csv_sizes': [csv_file.tell() for csv_file in self.files]}
+
+        # written aside then renamed, a crash while saving keeps the previous checkpoint
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.path + '.tmp', self.path)
+
+
+def load_checkpoint(path, file_in):
+    """Return the checkpoint saved for the OSM file, None when there is none"""
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as checkpoint_file:
+        state = json.load(checkpoint_file)
+
+    if state['osm_file'] != os.path.abspath(file_in) or state['osm_size'] != os.path.getsize(file_in):
+        raise ValueError("the checkpoint {0} was saved for another version of {1}".format(path, state['osm_file']))
+
+    return state
+
+
+def resume_stream(file_in, state):
+    """Return a ShardFile of the OSM file from the element following the last element of the checkpoint"""
+    tag, element_id = state['last']
+
+    with open(file_in, 'rb') as osm_file:
+        start = osm_shards.find_element(osm_file, tag, element_id, state['offset'])
+        if start is None:
+            raise ValueError("{0} {1} of the checkpoint is not in {2}".format(tag, element_id, file_in))
+
+        end = osm_shards.find_osm_end(osm_file)
+        boundary = osm_shards.find_boundary(osm_file, start + 1, end)
+
+    return osm_shards.ShardFile(file_in, end if boundary is None else boundary, end)
+
+
+def process_map_checkpointed(file_in, validate, cleaner, parser, stats, checkpoint_path, resume,
+                             interval=CHECKPOINT_INTERVAL, element_filter=None):
+    """Serial process_map saving a checkpoint every interval elements.
+    With resume, the csv files are truncated to the last checkpoint and the conversion carries on
+    from the element following it. The checkpoint is removed once the map is fully converted.
+    """
+    if osm_input.compression(file_in):
+        raise ValueError("resumable runs need random access, decompress {0} first".format(file_in))
+
+    paths = [path for _, path, _ in CSV_OUTPUTS]
+    state = load_checkpoint(checkpoint_path, file_in) if resume else None
+
+    if state:
+        stream = resume_stream(file_in, state)
+        files, writers = reopen_csv_writers(paths, state['csv_sizes'])
+    else:
+        stream = open(file_in, 'rb')
+        files, writers = open_csv_writers(paths)
+
+    try:
+        checkpointer = Checkpointer(checkpoint_path, file_in, stream, files, writers, interval,
+                                    state['elements'] if state else 0)
+        write_map(stream, writers, validate, cleaner, parser, stats, checkpointer, element_filter)
+    finally:
+        stream.close()
+        close_csv_writers(files, writers)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+class RecordShaper(object):
+    """Pipeline work shaping a batch of element parts to compact records, validated when validate is True"""
+
+    def __init__(self, validate, cleaner=None):
+        self.validate = validate
+        self.cleaner = cleaner
+        self.validator = None
+
+    def __call__(self, batch):
+        records = [shape_parts(tag, attrib, tags, refs, self.cleaner) for tag, attrib, tags, refs in batch]
+
+        if self.validate is True:
+            # created in the worker process, a validator is not sent through the queues
+            self.validator = self.validator or cerberus.Validator()
+            validate_records(records, self.validator)
+
+        return records
+
+
+def process_map_pipelined(file_in, validate, workers=None, cleaner=None, parser=osm_parsers.DEFAULT_PARSER,
+                          element_filter=None):
+    """Process the map in a pipeline: a parser thread, workers processes shaping and validating batches of elements
+    and the main process writing the records in the map order. Returns the osm_pipeline.Pipeline with its counters.
+    Unlike sharding, the map is read sequentially so compressed maps can be converted in parallel.
+    """
+    files, writers = open_csv_writers([path for _, path, _ in CSV_OUTPUTS])
+    try:
+        pipeline = osm_pipeline.Pipeline(RecordShaper(validate, cleaner),
+                                         lambda records: write_batch(records, writers, False, None), workers)
+        pipeline.run(osm_parsers.iter_parts(file_in, osm_parsers.ELEMENT_TAGS, parser, element_filter))
+    finally:
+        close_csv_writers(files, writers)
+
+    return pipeline
+
+
+# ================================================== #
+#               Cleaning Function                    #
+# ================================================== #
+# the cleaning patterns and mappings are compiled once, not on every call
+ARABIC_TEXT = re.compile(r'^[\u0600-\u06ff\s\u0031-\u0039]+$')
+
+STREET_TYPE_MAPPING = {"St": "Street",
+                       "St.": "Street",
+                       "Rd": "Road",
+                       "Rd.": "Road"}
+
+# mapping of erroneous phone numbers
+PHONE_MAPPING = {"90000002": "+966920000002", "92000702": "+966920000702"}
+
+#standard numbers formats in Saudi Arabia
+HOME_NUM = re.compile(r'^(00966|\+966|966)?0?1?1?([\d]{7})$', re.IGNORECASE)
+MOBILE_NUM = re.compile(r'^(00966|\+966|966)?0?(5[\d]{8})$', re.IGNORECASE)
+UNI_NUM = re.compile(r'^(00966|\+966|966)?(9200[\d]{5})$', re.IGNORECASE)
+TOLL_FREE_NUM = re.compile(r'^(00966|\+966|966)?(800[\d]{7})$', re.IGNORECASE)
+
+# phone formats in the order they are tried, with their standard replacement
+PHONE_FORMATS = [(TOLL_FREE_NUM, r'+966\2'),
+                 (UNI_NUM, r'+966\2'),
+                 (MOBILE_NUM, r'+966\2'),
+                 (HOME_NUM, r'+96611\2')]
+
+
+# tag keys whose values are cleaned
+CLEANED_KEYS = ['addr:street', 'phone']
+
+
+def clean(tag):
+
+    return cleanTagValue(tag.attrib['k'], tag.attrib['v'])
+
+
+def cleanTagValue(tagKey, tagValue):
+    """Clean the value of a tag according to its key"""
+
+    if tagKey=='addr:street':
+        tagValue=cleanStreetName(tagValue)
+    elif tagKey=='phone':
+        tagValue=cleanPhoneNumber(tagValue)
+    return tagValue
+
+
+
+
+    # fixing the case for english names
+def cleanStreetName(streetName):
+    """This function takes a string of street name and clean it in terms of case used and street type"""
+
+    # only clean english text
+    if not ARABIC_TEXT.search(streetName):
+        # removing starting and ending whitespace
+        # and fixing the case of every word which is not an abbreviation
+        streetName = [word if word.isupper() else word.title() for word in streetName.strip().split()]
+
+        # return the last item in the list which possibly represent the type
+        streetType = streetName[-1]
+
+        if streetType in STREET_TYPE_MAPPING:
+            # replace the old type with the new one
+            streetName[-1] = STREET_TYPE_MAPPING[streetType]
+
+        streetName = ' '.join(streetName)
+
+    return streetName
+
+def cleanPhoneNumber(phone):
+    """This function take a string phone number and reformat it."""
+
+    if ";" in phone:
+        phone = phone.split(';')[0]
+
+    # toll free, universal access, mobile then home numbers
+    for pattern, standard in PHONE_FORMATS:
+        if pattern.match(phone):
+            return pattern.sub(standard, phone)
+
+    # invalid numbers
+    return PHONE_MAPPING[phone]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH,
+                        help="OSM file to convert, .bz2, .gz and .xz files are decompressed on the fly")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes converting shards of the map in parallel (0 for one per cpu)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="shape the elements in --workers processes fed by a parser thread instead of shards")
+    parser.add_argument('--no-validate', action='store_true', help="skip the schema validation")
+    parser.add_argument('--parser', choices=sorted(osm_parsers.PARSERS), default=osm_parsers.DEFAULT_PARSER,
+                        help="XML parser backend")
+    parser.add_argument('--clean', action='store_true', help="clean the street names and phone numbers")
+    parser.add_argument('--clean-cache-size', type=int, default=clean_cache.CACHE_SIZE,
+                        help="entries of the cleaning LRU cache")
+    parser.add_argument('--clean-cache', help="json file keeping the cleaning cache between runs")
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help="save a checkpoint of the serial run to FILE every --checkpoint-interval elements")
+    parser.add_argument('--checkpoint-interval', type=int, default=CHECKPOINT_INTERVAL,
+                        help="elements converted between two checkpoints")
+    parser.add_argument('--resume', action='store_true',
+                        help="carry on from the checkpoint of a failed run (--checkpoint, default {0})".format(
+                            CHECKPOINT_PATH))
+    parser.add_argument('--node-store', metavar='DIR',
+                        help="store the node coordinates in DIR for the way geometries (needs numpy)")
+    osm_filters.add_arguments(parser)
+    parser.add_argument('--stats', action='store_true',
+                        help="time the stages of a serial run by element type and print a report at the end")
+    parser.add_argument('--progress', type=float, metavar='SECONDS',
+                        help="with --stats, print the elements/sec and RSS every SECONDS")
+    parser.add_argument('--profile', metavar='FILE', help="profile the run with cProfile and save the stats to FILE")
+    parser.add_argument('--trace-memory', type=int, metavar='N',
+                        help="trace the allocations with tracemalloc (python 3) and print the N biggest")
+    args = parser.parse_args()
+
+    if (args.stats or args.progress) and (args.pipeline or args.workers != 1):
+        parser.error("--stats and --progress only time serial runs, not --workers or --pipeline")
+
+    cleaner = None
+    if args.clean:
+        cleaner = clean_cache.CleaningCache(cleanTagValue, CLEANED_KEYS, args.clean_cache_size, args.clean_cache)
+
+    stats = osm_instrument.StageStats(args.progress) if args.stats or args.progress else None
+
+    with osm_instrument.profiling(args.profile, args.trace_memory):
+        result = process_map(args.osm_file, validate=not args.no_validate, workers=args.workers or None,
+                             cleaner=cleaner, parser=args.parser, pipeline=args.pipeline, stats=stats,
+                             checkpoint=args.checkpoint or (CHECKPOINT_PATH if args.resume else None),
+                             resume=args.resume, checkpoint_interval=args.checkpoint_interval,
+                             element_filter=osm_filters.from_arguments(args), node_store_dir=args.node_store)
+
+    if stats:
+        for line in stats.report():
+            print(line)
+
+    if args.pipeline:
+        for line in result.report():
+            print(line)
+
+    # the cache of the workers is not merged back, only a serial run has counters and new entries to save
+    if cleaner and args.workers == 1 and not args.pipeline:
+        print(cleaner.stats())
+        if args.clean_cache:
+            cleaner.save()
+
+